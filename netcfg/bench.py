@@ -0,0 +1,520 @@
+import BaseHTTPServer
+import collections
+import hashlib
+import json
+import logging
+import os
+import Queue
+import re
+import socket
+import SocketServer
+import subprocess
+import threading
+import time
+
+from . import client
+from . import utils
+
+logger = logging.getLogger('netcfg.bench')
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+class FakeDockerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Handler implementing the subset of the Docker remote API used by netcfg.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, code, data):
+        """
+        Sends a JSON response.
+
+        :param code: HTTP status code
+        :param data: Response data
+        """
+
+        body = json.dumps(data)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_events(self):
+        """
+        Streams container events using chunked transfer encoding.
+        """
+
+        events = Queue.Queue()
+        self.server.subscribe(events)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        try:
+            while True:
+                event = events.get()
+                if event is None:
+                    break
+
+                data = json.dumps(event) + '\n'
+                self.wfile.write('%x\r\n%s\r\n' % (len(data), data))
+                self.wfile.flush()
+        except socket.error:
+            pass
+        finally:
+            self.server.unsubscribe(events)
+            self.close_connection = 1
+
+    def do_GET(self):
+        path = re.sub(r'^/v[0-9.]+', '', self.path.split('?')[0])
+
+        if path == '/events':
+            self.send_events()
+        elif path == '/containers/json':
+            self.send_json(200, self.server.list_containers())
+        else:
+            match = re.match(r'^/containers/([^/]+)/json$', path)
+            info = self.server.inspect_container(match.group(1)) if match else None
+            if info is None:
+                self.send_json(404, {'message': 'No such container.'})
+            else:
+                self.send_json(200, info)
+
+
+class FakeDockerServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """
+    Fake Docker daemon serving synthetic containers, which are processes in
+    their own network namespace created by `unshare`.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path):
+        """
+        Class constructor.
+
+        :param path: Path to the Docker socket to serve
+        """
+
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+        SocketServer.UnixStreamServer.__init__(self, path, FakeDockerHandler)
+        self.path = path
+        self.lock = threading.Lock()
+        self.containers = {}
+        self.subscribers = []
+
+    def subscribe(self, events):
+        with self.lock:
+            self.subscribers.append(events)
+
+    def unsubscribe(self, events):
+        with self.lock:
+            if events in self.subscribers:
+                self.subscribers.remove(events)
+
+    def emit(self, status, container_id):
+        """
+        Sends a container event to all event stream subscribers.
+
+        :param status: Event status
+        :param container_id: Container identifier
+        """
+
+        event = {
+            'status': status,
+            'id': container_id,
+            'from': 'netcfg-bench',
+            'time': int(time.time()),
+        }
+
+        with self.lock:
+            for events in self.subscribers:
+                events.put(event)
+
+    def start_container(self, name):
+        """
+        Starts a synthetic container in a new network namespace.
+
+        :param name: Container name
+        """
+
+        container_id = hashlib.sha256(name).hexdigest()
+        process = subprocess.Popen(['unshare', '--net', 'sleep', 'infinity'])
+        with self.lock:
+            self.containers[container_id] = {
+                'name': name,
+                'process': process,
+            }
+
+        self.emit('start', container_id)
+
+    def stop_container(self, name):
+        """
+        Stops a synthetic container, which destroys its network namespace.
+
+        :param name: Container name
+        """
+
+        container_id = hashlib.sha256(name).hexdigest()
+        with self.lock:
+            container = self.containers.get(container_id)
+            if container is None or container['process'] is None:
+                return
+
+            process = container['process']
+            container['process'] = None
+
+        process.kill()
+        process.wait()
+        self.emit('stop', container_id)
+
+    def stop_all(self):
+        """
+        Stops all synthetic containers and terminates event streams.
+        """
+
+        for container in self.containers.values():
+            self.stop_container(container['name'])
+
+        with self.lock:
+            self.containers = {}
+            for events in self.subscribers:
+                events.put(None)
+
+    def list_containers(self):
+        with self.lock:
+            return [
+                {'Id': container_id, 'Names': ['/%s' % container['name']]}
+                for container_id, container in self.containers.items()
+                if container['process'] is not None
+            ]
+
+    def inspect_container(self, identifier):
+        with self.lock:
+            for container_id, container in self.containers.items():
+                if identifier in (container_id, container_id[:12], container['name']):
+                    process = container['process']
+                    return {
+                        'Id': container_id,
+                        'Name': '/%s' % container['name'],
+                        'State': {
+                            'Running': process is not None,
+                            'Pid': process.pid if process is not None else 0,
+                        },
+                    }
+
+        return None
+
+
+class Statistics(object):
+    """
+    Latency samples of benchmarked operations.
+    """
+
+    def __init__(self):
+        """
+        Class constructor.
+        """
+
+        self.lock = threading.Lock()
+        self.samples = collections.defaultdict(list)
+        self.errors = collections.defaultdict(int)
+        self.periods = {}
+
+    def add(self, operation, duration, error=False):
+        """
+        Records a single operation.
+
+        :param operation: Operation name
+        :param duration: Duration in seconds
+        :param error: Did the operation fail
+        """
+
+        now = time.time()
+        with self.lock:
+            self.samples[operation].append(duration)
+            if error:
+                self.errors[operation] += 1
+
+            # Track the period during which the operation was performed
+            started, _ = self.periods.get(operation, (now - duration, now))
+            self.periods[operation] = (min(started, now - duration), now)
+
+    def percentile(self, samples, percent):
+        """
+        Returns a percentile of sorted samples (nearest rank).
+        """
+
+        index = max(0, int(round(percent / 100.0 * len(samples))) - 1)
+        return samples[min(index, len(samples) - 1)]
+
+    def format_report(self):
+        """
+        Returns a table with throughput and latency percentiles (in ms) of
+        each operation.
+        """
+
+        lines = ['%-16s %8s %7s %10s %9s %9s %9s %9s' % (
+            'operation', 'count', 'errors', 'ops/s', 'p50', 'p90', 'p99', 'max')]
+        for operation in sorted(self.samples):
+            samples = sorted(self.samples[operation])
+            started, finished = self.periods[operation]
+            elapsed = finished - started
+            lines.append('%-16s %8d %7d %10.1f %9.2f %9.2f %9.2f %9.2f' % (
+                operation,
+                len(samples),
+                self.errors[operation],
+                len(samples) / elapsed if elapsed else 0.0,
+                self.percentile(samples, 50) * 1000,
+                self.percentile(samples, 90) * 1000,
+                self.percentile(samples, 99) * 1000,
+                samples[-1] * 1000,
+            ))
+
+        return '\n'.join(lines)
+
+
+class Benchmark(object):
+    """
+    Load generator for a running netcfg daemon. The daemon must be using the
+    fake Docker socket served by the benchmark.
+    """
+
+    def __init__(self, ipc_socket_path, events_socket_path, docker_socket_path, networks=10,
+                 containers=100, concurrency=4, rate=None, timeout=30, prefix='nbench'):
+        """
+        Class constructor.
+
+        :param ipc_socket_path: Path to netcfg socket
+        :param events_socket_path: Path to netcfg change events socket
+        :param docker_socket_path: Path to the fake Docker socket to serve
+        :param networks: Number of bridge networks to create
+        :param containers: Number of synthetic containers
+        :param concurrency: Number of concurrent clients
+        :param rate: Optional maximum number of operations per second
+        :param timeout: Seconds to wait for a started container to be ready
+        :param prefix: Prefix of network and container names
+        """
+
+        if networks < 1:
+            raise BenchmarkError('At least one network is required.')
+
+        self.ipc_socket_path = ipc_socket_path
+        self.events_socket_path = events_socket_path
+        self.docker = FakeDockerServer(docker_socket_path)
+        self.network_names = ['%s%d' % (prefix[:10], i) for i in xrange(networks)]
+        self.container_names = ['%s-c%d' % (prefix, i) for i in xrange(containers)]
+        self.concurrency = concurrency
+        self.limiter = utils.TokenBucket(rate) if rate else None
+        self.limiter_lock = threading.Lock()
+        self.timeout = timeout
+        self.prefix = prefix
+        self.stats = Statistics()
+        self.local = threading.local()
+        self.ready_lock = threading.Lock()
+        self.ready = {}
+
+    def get_client(self):
+        """
+        Returns a client for the current thread.
+        """
+
+        if not hasattr(self.local, 'client'):
+            self.local.client = client.Client(self.ipc_socket_path, self.events_socket_path)
+
+        return self.local.client
+
+    def throttle(self):
+        """
+        Waits until the rate limit allows another operation.
+        """
+
+        if self.limiter is None:
+            return
+
+        with self.limiter_lock:
+            while not self.limiter.consume():
+                time.sleep(self.limiter.delay())
+
+    def call(self, method, *args, **kwargs):
+        """
+        Calls a client method and records its latency.
+        """
+
+        self.throttle()
+        started = time.time()
+        rsp = getattr(self.get_client(), method)(*args, **kwargs)
+        self.stats.add(method, time.time() - started, error='error' in rsp)
+        return rsp
+
+    def run_parallel(self, function, items):
+        """
+        Calls a function for every item using concurrent worker threads.
+
+        :param function: Function to call
+        :param items: List of items
+        """
+
+        queue = Queue.Queue()
+        for item in items:
+            queue.put(item)
+
+        def worker():
+            while True:
+                try:
+                    item = queue.get_nowait()
+                except Queue.Empty:
+                    return
+
+                try:
+                    function(item)
+                except:
+                    logger.exception("Benchmark operation failed.")
+
+        workers = [threading.Thread(target=worker) for _ in xrange(self.concurrency)]
+        for thread in workers:
+            thread.daemon = True
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+    def watch_events(self):
+        """
+        Thread entry point that marks containers as ready when the daemon
+        reports their configuration as applied.
+        """
+
+        cli = client.Client(self.ipc_socket_path, self.events_socket_path)
+        for event in cli.subscribe(events=['container_applied', 'container_failed'], resync=False):
+            if event.get('detach'):
+                continue
+
+            with self.ready_lock:
+                waiter = self.ready.get(event['container'])
+
+            if waiter is not None:
+                waiter['failed'] = event['event'] == 'container_failed'
+                waiter['event'].set()
+
+    def get_address(self, index):
+        """
+        Returns the address of a synthetic container.
+        """
+
+        index += 1
+        return '10.%d.%d.%d/8' % ((index >> 16) & 255, (index >> 8) & 255, index & 255)
+
+    def attach(self, index):
+        name = self.container_names[index]
+        network = self.network_names[index % len(self.network_names)]
+        self.call('attach', name, network, address=[self.get_address(index)])
+
+    def start(self, name):
+        waiter = {'event': threading.Event(), 'failed': False}
+        with self.ready_lock:
+            self.ready[name] = waiter
+
+        self.throttle()
+        started = time.time()
+        self.docker.start_container(name)
+        ready = waiter['event'].wait(self.timeout)
+        self.stats.add('start_to_ready', time.time() - started, error=not ready or waiter['failed'])
+
+    def detach(self, index):
+        name = self.container_names[index]
+        network = self.network_names[index % len(self.network_names)]
+        self.call('detach', name, network)
+
+    def run(self):
+        """
+        Runs the benchmark and cleans up afterwards.
+
+        :return: Statistics instance
+        """
+
+        # Configuration of a replication follower can not be changed, so
+        # neither the benchmark nor its cleanup would work
+        rsp = self.get_client().get_stats()
+        replication = rsp.get('stats', {}).get('replication')
+        if replication is not None and replication['role'] == 'follower':
+            self.close()
+            raise BenchmarkError('Daemon is a replication follower, run the benchmark against the leader.')
+
+        server = threading.Thread(target=self.docker.serve_forever)
+        server.daemon = True
+        server.start()
+
+        watcher = threading.Thread(target=self.watch_events)
+        watcher.daemon = True
+        watcher.start()
+
+        # Wait for the daemon to subscribe to events of the fake Docker daemon
+        deadline = time.time() + self.timeout
+        while not self.docker.subscribers and time.time() < deadline:
+            time.sleep(0.1)
+        if not self.docker.subscribers:
+            logger.warning("Daemon is not subscribed to events of the fake Docker socket '%s'.", self.docker.path)
+
+        # Give the change events subscriber time to connect
+        time.sleep(0.5)
+
+        try:
+            self.run_parallel(lambda name: self.call('create_network', 'bridge', name), self.network_names)
+            self.run_parallel(self.attach, range(len(self.container_names)))
+            self.run_parallel(self.start, self.container_names)
+            self.run_parallel(self.detach, range(len(self.container_names)))
+            self.run_parallel(self.docker.stop_container, self.container_names)
+        finally:
+            self.cleanup()
+
+        return self.stats
+
+    def cleanup(self):
+        """
+        Stops synthetic containers and removes benchmark configuration and
+        bridges.
+        """
+
+        self.docker.stop_all()
+
+        cli = self.get_client()
+        config = cli.get_config()['config']
+        for name in self.container_names:
+            config['containers'].pop(name, None)
+        for name in self.network_names:
+            config['networks'].pop(name, None)
+        rsp = cli.set_config(config)
+        if 'error' in rsp:
+            logger.error("Failed to remove benchmark configuration: %s", rsp['error'])
+
+        for name in self.network_names:
+            if os.path.isdir(os.path.join('/sys/class/net', name)):
+                subprocess.call(['ip', 'link', 'delete', name])
+
+        self.docker.shutdown()
+        self.close()
+
+    def close(self):
+        """
+        Closes the fake Docker socket.
+        """
+
+        self.docker.server_close()
+        try:
+            os.unlink(self.docker.path)
+        except OSError:
+            pass
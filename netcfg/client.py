@@ -1,19 +1,30 @@
 import json
+import time
 import zmq
 
+# Number of seconds without a readiness event after which the daemon is asked
+# for the outcome directly
+READY_POLL_INTERVAL = 0.25
+
 
 class Client(object):
     """
     Netcfg client API.
     """
 
-    def __init__(self, ipc_socket_path):
+    def __init__(self, ipc_socket_path, events_socket_path=None):
         """
         Class constructor.
 
         :param socket: Path to netcfg socket
+        :param events_socket_path: Path to netcfg change events socket (defaults
+          to the IPC socket path with an '.events' suffix)
         """
 
+        if events_socket_path is None:
+            events_socket_path = '%s.events' % ipc_socket_path
+
+        self.events_socket_path = events_socket_path
         self.context = zmq.Context()
         self.socket = self.context.socket(zmq.REQ)
         self.socket.connect('ipc://%s' % ipc_socket_path)
@@ -35,9 +46,57 @@ class Client(object):
 
         return self._method('get_config')
 
+    def get_stats(self):
+        """
+        Returns netcfg daemon statistics.
+        """
+
+        return self._method('get_stats')
+
+    def query(self, network=None, container=None, address=None, fields=None, cursor=None, limit=None):
+        """
+        Returns one page of configuration matching the given filters. The
+        response contains a `cursor` that can be used to request the next
+        page; it is None when there are no more results.
+
+        :param network: Network name
+        :param container: Container name pattern (for example 'web-*')
+        :param address: Address or IP network containing container addresses
+        :param fields: List of network configuration keys to include
+        :param cursor: Cursor from the previous page
+        :param limit: Maximum number of containers in the page
+        """
+
+        return self._method(
+            'query',
+            network=network,
+            container=container,
+            address=address,
+            fields=fields,
+            cursor=cursor,
+            limit=limit,
+        )
+
+    def query_all(self, **kwargs):
+        """
+        Generator that yields all configuration pages matching the given
+        filters. Accepts the same arguments as `query`.
+        """
+
+        cursor = None
+        while True:
+            rsp = self.query(cursor=cursor, **kwargs)
+            yield rsp
+            if 'error' in rsp or not rsp['cursor']:
+                break
+
+            cursor = rsp['cursor']
+
     def set_config(self, config):
         """
         Overwrites the current netcfg configuration.
+
+        :param config: Serialized configuration
         """
 
         return self._method('set_config', config=config)
@@ -62,21 +121,93 @@ class Client(object):
             config=kwargs,
         )
 
-    def attach(self, container, network, **kwargs):
+    def attach(self, container, network, wait_ready=None, **kwargs):
         """
         Attaches a network to a container.
 
         :param container: Container identifier
         :param network: Network identifier
+        :param wait_ready: Optional number of seconds the daemon tracks
+          readiness of the applied configuration for, which is not stored
+          in the configuration
         """
 
+        request = {}
+        if wait_ready is not None:
+            request['wait_ready'] = wait_ready
+
         return self._method(
             'attach',
             container=container,
             network=network,
             config=kwargs,
+            **request
         )
 
+    def get_readiness(self, container, network):
+        """
+        Returns the readiness status of configuration applied with
+        `wait_ready`, or None when it is unknown.
+
+        :param container: Container name
+        :param network: Network name
+        """
+
+        return self._method(
+            'get_readiness',
+            container=container,
+            network=network,
+        )['readiness']
+
+    def attach_and_wait(self, container, network, timeout, **kwargs):
+        """
+        Attaches a network to a container and waits until the daemon reports
+        that the configuration is usable. The outcome is stored under `ready`
+        in the response: the number of seconds until the configuration became
+        usable, or None if it did not become usable in time.
+
+        :param container: Container identifier
+        :param network: Network identifier
+        :param timeout: Maximum number of seconds to wait
+        """
+
+        # A subscription only takes effect some time after connecting, so the
+        # event may still be missed and the daemon is also asked directly
+        # whenever no event arrives for a while
+        socket = self.context.socket(zmq.SUB)
+        socket.connect('ipc://%s' % self.events_socket_path)
+        socket.setsockopt(zmq.SUBSCRIBE, 'network_ready')
+
+        try:
+            rsp = self.attach(container, network, wait_ready=timeout, **kwargs)
+            if not rsp.get('applied'):
+                return rsp
+
+            # Allow some time for the daemon to notice the deadline
+            deadline = time.time() + timeout + 1
+            rsp['ready'] = None
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+
+                if socket.poll(int(min(remaining, READY_POLL_INTERVAL) * 1000)):
+                    _, payload = socket.recv_multipart()
+                    event = json.loads(payload)
+                    if event['container'] == rsp['container'] and event['network'] == rsp['network']:
+                        rsp['ready'] = event['ready']
+                        break
+                    continue
+
+                status = self.get_readiness(rsp['container'], rsp['network'])
+                if status is None or not status['pending']:
+                    rsp['ready'] = status['ready'] if status is not None else None
+                    break
+
+            return rsp
+        finally:
+            socket.close()
+
     def detach(self, container, network):
         """
         Detaches a network from a container.
@@ -90,3 +221,91 @@ class Client(object):
             container=container,
             network=network,
         )
+
+    def get_snapshot(self):
+        """
+        Returns the complete configuration as a `resync` event, together with
+        the sequence numbers of the last events it includes.
+        """
+
+        rsp = self.get_config()
+        return {
+            'event': 'resync',
+            'epoch': rsp['epoch'],
+            'seq': rsp['seq'],
+            'topic_seqs': rsp['topic_seqs'],
+            'config': rsp['config'],
+        }
+
+    def subscribe(self, events=None, resync=True):
+        """
+        Generator that yields change events published by the netcfg daemon.
+
+        Each event is a dictionary with at least the event type `event`, the
+        daemon instance identifier `epoch`, the sequence number `seq` and the
+        sequence number among events of the same type `topic_seq`. When
+        subscribed to all events, gaps are detected in `seq`, otherwise in
+        `topic_seq` of each subscribed type.
+
+        When resync is enabled, a `resync` event with the complete
+        configuration is yielded first, and again in place of missed events
+        whenever a gap is detected (because events were dropped or the daemon
+        was restarted). Events already included in a resynced configuration
+        are skipped. A subscription only takes effect some time after
+        connecting, so events published in the meantime are detected as a gap
+        once the next event is received.
+
+        :param events: Optional list of event types to subscribe to
+        :param resync: Should the configuration be fetched first and on gaps
+        """
+
+        socket = self.context.socket(zmq.SUB)
+        socket.connect('ipc://%s' % self.events_socket_path)
+        for event in events or ['']:
+            socket.setsockopt(zmq.SUBSCRIBE, str(event))
+
+        try:
+            epoch = None
+            last_seq = None
+            topic_seqs = {}
+            if resync:
+                snapshot = self.get_snapshot()
+                epoch = snapshot['epoch']
+                last_seq = snapshot['seq']
+                topic_seqs = snapshot.pop('topic_seqs')
+                yield snapshot
+
+            while True:
+                _, payload = socket.recv_multipart()
+                event = json.loads(payload)
+
+                if epoch is not None:
+                    if event['epoch'] == epoch and event['seq'] <= last_seq:
+                        # Already included in a resynced configuration
+                        continue
+
+                    if event['epoch'] != epoch:
+                        gap = True
+                    elif events:
+                        gap = event['topic_seq'] != topic_seqs.get(event['event'], 0) + 1
+                    else:
+                        gap = event['seq'] != last_seq + 1
+
+                    if gap and resync:
+                        snapshot = self.get_snapshot()
+                        epoch = snapshot['epoch']
+                        last_seq = snapshot['seq']
+                        topic_seqs = snapshot.pop('topic_seqs')
+                        yield snapshot
+
+                        if event['epoch'] == epoch and event['seq'] <= last_seq:
+                            continue
+
+                if event['epoch'] != epoch:
+                    topic_seqs = {}
+                epoch = event['epoch']
+                last_seq = event['seq']
+                topic_seqs[event['event']] = event['topic_seq']
+                yield event
+        finally:
+            socket.close()
@@ -1,7 +1,55 @@
+import bisect
+import collections
+import contextlib
 import docker
+import fnmatch
+import ipaddr
+import itertools
+import logging
+import subprocess
+import traceback
 
 from . import container
+from . import jsonstream
 from . import network
+from .network import state
+
+logger = logging.getLogger('netcfg.configuration')
+
+
+class ConfigurationApplyError(Exception):
+    pass
+
+
+class ContainerChange(object):
+    """
+    Difference between the configurations of a single container.
+    """
+
+    __slots__ = ('old', 'new', 'removed', 'added')
+
+    def __init__(self, old, new, removed, added):
+        """
+        Class constructor.
+
+        :param old: Container instance in the old configuration (or None)
+        :param new: Container instance in the new configuration (or None)
+        :param removed: List of attachments of the old container to remove
+        :param added: List of attachments of the new container to add
+        """
+
+        self.old = old
+        self.new = new
+        self.removed = removed
+        self.added = added
+
+    @property
+    def name(self):
+        """
+        Name of the changed container.
+        """
+
+        return (self.new or self.old).name
 
 
 class Configuration(object):
@@ -9,11 +57,14 @@ class Configuration(object):
     Netcfg configuration store.
     """
 
-    def __init__(self, docker_socket_path):
+    def __init__(self, docker_socket_path, ledger=None, readiness=None):
         """
         Class constructor.
 
         :param docker_socket_path: Path to Docker socket
+        :param ledger: Optional ledger of applied configuration
+        :param readiness: Optional `ReadinessTracker` instance, which tracks
+          applied configuration until it becomes usable
         """
 
         self.docker_client = docker.Client(
@@ -21,8 +72,31 @@ class Configuration(object):
             version='1.12',
             timeout=10
         )
+        self.ledger = ledger
+        self.readiness = readiness
         self.networks = {}
         self.containers = {}
+        self.container_names = None
+        self.container_states = None
+
+    @contextlib.contextmanager
+    def cache_container_states(self):
+        """
+        Context manager that caches the state of Docker containers while
+        configuration is being applied, so that each container is inspected
+        only once no matter how many networks are applied and recorded.
+        """
+
+        if self.container_states is not None:
+            # Already cached by an outer apply
+            yield
+            return
+
+        self.container_states = {}
+        try:
+            yield
+        finally:
+            self.container_states = None
 
     def get_docker_client(self):
         """
@@ -70,8 +144,39 @@ class Configuration(object):
 
         cont = container.Container(self, name)
         self.containers[name] = cont
+        if self.container_names is not None:
+            bisect.insort(self.container_names, name)
         return cont
 
+    def get_container_names(self):
+        """
+        Returns a sorted list of container names. The list is kept between
+        calls and must not be modified.
+        """
+
+        if self.container_names is None:
+            self.container_names = sorted(self.containers)
+
+        return self.container_names
+
+    def get_network_container_names(self, net):
+        """
+        Returns a sorted list of names of containers attached to a network.
+        Networks do not reference their containers, so the list is built by
+        scanning all containers on first use and is then kept up to date by
+        the network. The list must not be modified.
+
+        :param net: Network instance
+        """
+
+        if net.container_names is None:
+            net.container_names = sorted([
+                ctr.name for ctr in self.containers.values()
+                if ctr.get_attachment(net) is not None
+            ])
+
+        return net.container_names
+
     def get_container(self, name):
         """
         Returns a container instance by its name.
@@ -79,14 +184,426 @@ class Configuration(object):
 
         return self.containers[name]
 
+    def query(self, network=None, container=None, address=None, fields=None, cursor=None, limit=None):
+        """
+        Returns a filtered part of the serialized configuration. Containers
+        are returned ordered by name, so results may be paginated by passing
+        the returned cursor to subsequent queries.
+
+        :param network: Only include attachments to the network with this name
+        :param container: Only include containers matching this name pattern
+        :param address: Only include attachments with addresses inside this IP network
+        :param fields: Optional list of network configuration keys to include
+        :param cursor: Cursor returned by a previous query
+        :param limit: Maximum number of containers to return
+        :return: A tuple (serialized configuration, cursor for the next page or None)
+        """
+
+        if network is not None:
+            net = self.get_network(network)
+            names = self.get_network_container_names(net)
+        else:
+            net = None
+            names = self.get_container_names()
+
+        if address is not None:
+            address = ipaddr.IPNetwork(address)
+
+        # Patterns in the form of 'prefix*' only need to scan names with the prefix
+        prefix = None
+        if container is not None:
+            prefix = container.rstrip('*')
+            if any(c in prefix for c in '*?['):
+                prefix = None
+
+        start = 0
+        if prefix is not None:
+            start = bisect.bisect_left(names, prefix)
+        if cursor is not None:
+            start = max(start, bisect.bisect_right(names, cursor))
+
+        networks = {}
+        if net is not None:
+            networks[net.name] = net.serialize()
+
+        containers = {}
+        last_name = None
+        next_cursor = None
+        for name in itertools.islice(names, start, None):
+            if prefix is not None and not name.startswith(prefix):
+                break
+            if container is not None and not fnmatch.fnmatchcase(name, container):
+                continue
+
+            ctr = self.containers[name]
+            attachments = ctr.attachments
+            if net is not None:
+                attachments = [att for att in attachments if att.network is net]
+            if address is not None:
+                attachments = [att for att in attachments if att.has_address(address)]
+                if not attachments:
+                    continue
+
+            if limit is not None and len(containers) >= limit:
+                next_cursor = last_name
+                break
+
+            for attachment in attachments:
+                if attachment.network.name not in networks:
+                    networks[attachment.network.name] = attachment.network.serialize()
+
+            containers[name] = ctr.serialize(attachments=attachments, fields=fields)
+            last_name = name
+
+        return {
+            'networks': networks,
+            'containers': containers,
+        }, next_cursor
+
+    def diff_networks(self, other, applied=False):
+        """
+        Compares networks with another configuration.
+
+        :param other: Configuration instance
+        :param applied: Only consider changes that affect configuration
+          applied to containers
+        :return: A tuple of sets (added, removed, changed) with network names
+        """
+
+        added = set(other.networks) - set(self.networks)
+        removed = set(self.networks) - set(other.networks)
+        changed = set()
+        for name in set(self.networks) & set(other.networks):
+            if applied:
+                old = self.networks[name].get_applied_config()
+                new = other.networks[name].get_applied_config()
+            else:
+                old = self.networks[name].serialize()
+                new = other.networks[name].serialize()
+
+            if old != new:
+                changed.add(name)
+
+        return added, removed, changed
+
+    def diff(self, other):
+        """
+        Compares container attachments with another configuration. Attachments
+        to networks that have changed in a way that affects applied
+        configuration are considered to be changed as well.
+
+        :param other: Configuration instance
+        :return: List of `ContainerChange` instances
+        """
+
+        _, _, changed_networks = self.diff_networks(other, applied=True)
+
+        changes = []
+        for name in set(self.containers) | set(other.containers):
+            old = self.containers.get(name)
+            new = other.containers.get(name)
+            old_attachments = {att.network.name: att for att in old.attachments} if old else {}
+            new_attachments = {att.network.name: att for att in new.attachments} if new else {}
+
+            def is_changed(netname, attachment, attachments):
+                return (
+                    netname not in attachments or
+                    netname in changed_networks or
+                    not attachment.same_config(attachments[netname])
+                )
+
+            removed = [
+                att for netname, att in old_attachments.items()
+                if is_changed(netname, att, new_attachments)
+            ]
+            added = [
+                att for netname, att in new_attachments.items()
+                if is_changed(netname, att, old_attachments)
+            ]
+
+            if removed or added:
+                changes.append(ContainerChange(old, new, removed, added))
+
+        return changes
+
+    def apply_changes(self, changes, atomic=True):
+        """
+        Applies changes computed by `diff` to affected running containers. When
+        applying fails, all already applied changes are reverted and
+        `ConfigurationApplyError` is raised. Unless the changes are applied
+        atomically, failed changes are skipped instead and returned.
+
+        :param changes: List of `ContainerChange` instances
+        :param atomic: Should all changes be reverted when one of them fails
+        :return: List of (container name, network name) tuples of changes
+          that failed to apply
+        """
+
+        # Log of performed operations as (container, attachment, detach) tuples
+        performed = []
+        failed = []
+        try:
+            for change in changes:
+                ctr = change.new or change.old
+                if not ctr.is_running:
+                    continue
+
+                for attachment in change.removed:
+                    if not self.apply_change(change.old, attachment, detach=True, atomic=atomic):
+                        if atomic:
+                            raise ConfigurationApplyError(
+                                "Failed to detach network '%s' from container '%s'." % (
+                                    attachment.network.name, change.name))
+                        failed.append((change.name, attachment.network.name))
+                        continue
+                    performed.append((change.old, attachment, True))
+
+                for attachment in change.added:
+                    if not self.apply_change(change.new, attachment, atomic=atomic):
+                        # Remove any partially applied configuration
+                        self.apply_change(change.new, attachment, detach=True, atomic=atomic)
+                        if atomic:
+                            raise ConfigurationApplyError(
+                                "Failed to attach network '%s' to container '%s'." % (
+                                    attachment.network.name, change.name))
+                        failed.append((change.name, attachment.network.name))
+                        continue
+                    performed.append((change.new, attachment, False))
+        except ConfigurationApplyError:
+            self.revert_changes(performed)
+            raise
+        except:
+            logger.error("Exception raised while applying configuration changes:")
+            logger.error(traceback.format_exc())
+            self.revert_changes(performed)
+            raise ConfigurationApplyError('Exception raised while applying configuration changes.')
+
+        return failed
+
+    def apply_change(self, ctr, attachment, detach=False, atomic=True):
+        """
+        Applies a single attachment of a container. Unless the change is
+        part of an atomic set of changes, exceptions are logged and treated
+        as failures.
+
+        :param ctr: Container instance
+        :param attachment: Attachment instance
+        :param detach: Should the configuration be removed instead
+        :param atomic: Should exceptions be raised
+        :return: True if configuration has been applied successfully
+        """
+
+        if atomic:
+            return ctr.apply_network(attachment.network, attachment.config, detach=detach)
+
+        try:
+            return ctr.apply_network(attachment.network, attachment.config, detach=detach)
+        except:
+            logger.error("Exception raised while applying network '%s' to container '%s':",
+                         attachment.network.name, ctr.name)
+            logger.error(traceback.format_exc())
+            return False
+
+    def revert_changes(self, performed):
+        """
+        Reverts operations performed by `apply_changes`.
+
+        :param performed: List of (container, attachment, detach) tuples
+        """
+
+        logger.error("Failed to apply configuration changes, rolling back.")
+        for ctr, attachment, detach in reversed(performed):
+            try:
+                ctr.apply_network(attachment.network, attachment.config, detach=not detach)
+            except:
+                logger.error("Exception raised while rolling back container '%s':", ctr.name)
+                logger.error(traceback.format_exc())
+
+    def get_running_containers(self):
+        """
+        Returns a dictionary mapping names and identifiers of all running
+        containers to their identifiers, by using a single Docker call.
+        """
+
+        running = {}
+        for info in self.docker_client.containers():
+            running[info['Id']] = info['Id']
+            running[info['Id'][:12]] = info['Id']
+            for name in info.get('Names') or []:
+                # Skip names of links from other containers
+                if name.count('/') == 1:
+                    running[name[1:]] = info['Id']
+
+        return running
+
     def apply(self):
         """
-        Applies complete configuration to running containers.
+        Applies complete configuration to running containers, which are
+        listed by a single Docker call. When a ledger of applied configuration
+        is available, containers that still use the same network namespace
+        only get the networks that have changed.
+
+        :return: Dictionary mapping names of running containers to True if
+          their configuration has been applied successfully
         """
 
+        # Containers that get their complete configuration
+        pending = []
+        results = {}
+
+        try:
+            running = self.get_running_containers()
+        except:
+            logger.warning("Unable to list running containers, applying complete configuration.")
+            logger.warning(traceback.format_exc())
+            running = None
+
+        host_state = None
+        if running is not None and self.ledger is not None:
+            self.ledger.prune(set(running.values()))
+            try:
+                host_state = state.dump_host()
+            except (subprocess.CalledProcessError, OSError):
+                logger.warning("Unable to obtain state of host network namespace.")
+
         for ctr in self.containers.values():
-            if ctr.is_running:
-                ctr.apply()
+            if running is None:
+                if ctr.is_running:
+                    pending.append(ctr)
+                continue
+
+            if ctr.name not in running:
+                continue
+
+            if self.ledger is None:
+                pending.append(ctr)
+                continue
+
+            applied = self.ledger.get_applied(ctr.name, running[ctr.name])
+            if applied is None:
+                # Network namespace is new, apply complete configuration
+                pending.append(ctr)
+            else:
+                results[ctr.name] = self.reconcile_container(ctr, applied, host_state)
+
+        results.update(self.apply_containers(pending))
+        return results
+
+    def apply_containers(self, containers, wait_ready=None):
+        """
+        Applies complete configuration to running containers. Networks that
+        support batch apply get configured for all containers at once.
+
+        :param containers: List of container instances
+        :param wait_ready: Optional number of seconds to track readiness for
+        :return: Dictionary mapping container names to True if configuration
+          of all networks has been applied successfully
+        """
+
+        results = {}
+        batches = collections.OrderedDict()
+        with self.cache_container_states():
+            for ctr in containers:
+                results[ctr.name] = True
+                for attachment in ctr.attachments:
+                    if attachment.network.supports_batch_apply:
+                        batches.setdefault(attachment.network, []).append((ctr, attachment.config))
+                    elif not ctr.apply_network(attachment.network, attachment.config, wait_ready=wait_ready):
+                        results[ctr.name] = False
+
+            for net, items in batches.items():
+                applied = net.apply_batch(items)
+                for (ctr, netcfg), finished in zip(items, applied):
+                    if not ctr.network_applied(net, netcfg, finished is not None, finished, wait_ready=wait_ready):
+                        results[ctr.name] = False
+
+        return results
+
+    def reconcile_container(self, ctr, applied, host_state=None):
+        """
+        Applies only the difference between configuration recorded in the
+        ledger and the desired configuration of a running container. Networks
+        that support reconcile are only left alone when their kernel state
+        still matches the recorded configuration.
+
+        :param ctr: Container instance
+        :param applied: Applied networks as returned by `Ledger.get_applied`
+        :param host_state: Optional `KernelState` of the host namespace
+        :return: True if all changes have been applied successfully
+        """
+
+        desired = {att.network.name: att for att in ctr.attachments}
+        unchanged = set()
+        stale = []
+        for netname, entry in applied.items():
+            attachment = desired.get(netname)
+            if attachment is not None and entry['network'] == attachment.network.serialize():
+                net = attachment.network
+            else:
+                net_cls = network.get_class_for_type(entry['network']['type'])
+                net = net_cls(**net_cls.deserialize(entry['network']))
+
+            # Changes of network metadata do not require applying configuration again
+            if attachment is not None and net.get_applied_config() == attachment.network.get_applied_config():
+                # Networks that do not support reconcile are always applied again
+                if entry['config'] == attachment.config and attachment.network.supports_reconcile:
+                    unchanged.add(netname)
+                    continue
+
+                net = attachment.network
+
+            stale.append((net, entry['config']))
+
+        drifted = self.get_drifted_networks(ctr, [desired[netname] for netname in sorted(unchanged)], host_state)
+        for netname in drifted:
+            unchanged.discard(netname)
+            stale.append((desired[netname].network, desired[netname].config))
+
+        success = True
+        for net, netcfg in stale:
+            if not ctr.apply_network(net, netcfg, detach=True):
+                success = False
+
+        for netname, attachment in desired.items():
+            if netname not in unchanged:
+                if not ctr.apply_network(attachment.network, attachment.config):
+                    success = False
+
+        return success
+
+    def get_drifted_networks(self, ctr, attachments, host_state=None):
+        """
+        Compares recorded attachments of a running container with the kernel
+        state. When the state can not be obtained, all attachments are
+        considered to have drifted.
+
+        :param ctr: Container instance
+        :param attachments: List of attachments recorded in the ledger
+        :param host_state: Optional `KernelState` of the host namespace
+        :return: Set of names of networks that have drifted
+        """
+
+        if not attachments:
+            return set()
+
+        netns = str(self.ledger.records[ctr.name]['pid'])
+        try:
+            if host_state is None:
+                host_state = state.dump_host()
+            netns_state = state.dump_netns(netns)
+        except (subprocess.CalledProcessError, OSError):
+            logger.warning("Unable to obtain kernel state of container '%s', applying its networks again.", ctr.name)
+            return set([attachment.network.name for attachment in attachments])
+
+        drifted = set()
+        for attachment in attachments:
+            problems = attachment.network.verify(ctr, attachment.config, netns, host_state, netns_state)
+            if problems:
+                logger.warning("Network '%s' of container '%s' does not match the kernel state (%s), applying again.",
+                               attachment.network.name, ctr.name, '; '.join(problems))
+                drifted.add(attachment.network.name)
+
+        return drifted
 
     def flush(self):
         """
@@ -94,6 +611,7 @@ class Configuration(object):
         """
 
         self.containers = {}
+        self.container_names = None
         self.networks = {}
 
     def serialize(self):
@@ -110,15 +628,97 @@ class Configuration(object):
     def deserialize(self, data):
         """
         Deserializes configuration from data returned by a previous call to
-        `serialize` and stores it in the current configuration object.
+        `serialize` and stores it in the current configuration object. No
+        configuration is applied, so Docker is not contacted.
 
         :param data: Serialized data returned by `serialize`
         """
 
         self.networks = {}
         self.containers = {}
-        for netname, netcfg in data['networks'].items():
+        self.container_names = None
+        self.load_networks(data['networks'].items())
+        self.load_containers(data['containers'].items())
+        self.validate()
+
+    def load_networks(self, items):
+        """
+        Deserializes networks and adds them to the configuration.
+
+        :param items: Iterable of (name, serialized network) pairs
+        """
+
+        for netname, netcfg in items:
             net_cls = network.get_class_for_type(netcfg['type'])
             self.networks[netname] = net_cls(**net_cls.deserialize(netcfg))
 
-        self.containers = {k: container.Container.deserialize(v, self) for k, v in data['containers'].items()}
+    def load_containers(self, items):
+        """
+        Deserializes containers and adds them to the configuration. Networks
+        must already be loaded.
+
+        :param items: Iterable of (name, serialized container) pairs
+        """
+
+        self.container_names = None
+        for name, data in items:
+            self.containers[name] = container.Container.deserialize(data, self)
+
+    def validate(self):
+        """
+        Validates network configuration of all containers, in one batch for
+        each network. Raises `NetworkConfigurationError` on errors.
+        """
+
+        attachments = {}
+        for ctr in self.containers.values():
+            for attachment in ctr.attachments:
+                attachments.setdefault(attachment.network, []).append(attachment)
+
+        for net, net_attachments in attachments.items():
+            net.validate_attachments(net_attachments)
+
+    def load(self, fp):
+        """
+        Loads configuration from a file written by `dump`, or from any JSON
+        file with serialized configuration. The file is parsed incrementally,
+        one network or container at a time. No configuration is applied, so
+        Docker is not contacted.
+
+        :param fp: File-like object to read from
+        """
+
+        self.networks = {}
+        self.containers = {}
+        self.container_names = None
+
+        # Containers can only be loaded after networks, which normally come first
+        networks_loaded = False
+        pending = []
+        reader = jsonstream.JSONStreamReader(fp)
+        for key, members in reader.iter_object(nested=('networks', 'containers')):
+            if key == 'networks':
+                self.load_networks(members)
+                networks_loaded = True
+            elif key == 'containers':
+                if networks_loaded:
+                    self.load_containers(members)
+                else:
+                    pending = list(members)
+
+        self.load_containers(pending)
+        self.validate()
+
+    def dump(self, fp):
+        """
+        Writes serialized configuration to a file, one network or container
+        at a time, so the complete serialized configuration is never held in
+        memory.
+
+        :param fp: File-like object to write to
+        """
+
+        jsonstream.dump_object(fp, [
+            ('networks', ((k, v.serialize()) for k, v in self.networks.items())),
+            ('containers', ((k, v.serialize()) for k, v in self.containers.items())),
+        ])
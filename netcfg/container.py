@@ -1,10 +1,99 @@
 
 
+import ipaddr
+import logging
+import time
+
+from . import utils
+
+logger = logging.getLogger('netcfg.container')
+
+
+class Attachment(object):
+    """
+    Compact record of a network attached to a container. Addresses are kept
+    in packed form and the remaining network-specific options as a tuple of
+    `(key, value)` pairs.
+    """
+
+    __slots__ = ('network', 'addresses', 'options')
+
+    def __init__(self, network, netcfg):
+        """
+        Class constructor.
+
+        :param network: Attached network
+        :param netcfg: Network-specific configuration
+        """
+
+        self.network = network
+        self.addresses = None
+
+        if netcfg is None:
+            self.options = None
+            return
+
+        options = []
+        for key, value in netcfg.items():
+            if key == 'address' and isinstance(value, list):
+                self.addresses = tuple([utils.pack_address(address) for address in value])
+            else:
+                options.append((utils.intern_string(key), utils.intern_string(value)))
+
+        options.sort()
+        self.options = tuple(options)
+
+    @property
+    def config(self):
+        """
+        Network-specific configuration in the same form as it was given
+        when attaching the network.
+        """
+
+        if self.options is None:
+            return None
+
+        netcfg = dict(self.options)
+        if self.addresses is not None:
+            netcfg['address'] = [utils.unpack_address(address) for address in self.addresses]
+
+        return netcfg
+
+    def same_config(self, other):
+        """
+        Checks whether another attachment record has the same network-specific
+        configuration.
+
+        :param other: Attachment instance
+        """
+
+        return self.addresses == other.addresses and self.options == other.options
+
+    def has_address(self, network):
+        """
+        Checks whether any of the attachment's addresses is inside the given
+        IP network.
+
+        :param network: An `ipaddr.IPNetwork` instance
+        """
+
+        for address in self.addresses or ():
+            try:
+                if ipaddr.IPNetwork(utils.unpack_address(address)).ip in network:
+                    return True
+            except ValueError:
+                continue
+
+        return False
+
+
 class Container(object):
     """
     Container settings descriptor.
     """
 
+    __slots__ = ('config', 'name', 'attachments')
+
     def __init__(self, config, name):
         """
         Class constructor.
@@ -14,8 +103,8 @@ class Container(object):
         """
 
         self.config = config
-        self.name = name
-        self.networks = {}
+        self.name = utils.intern_string(name)
+        self.attachments = ()
 
     @property
     def is_running(self):
@@ -30,38 +119,74 @@ class Container(object):
             # TODO: We should not catch all the exceptions here
             return False
 
-    def get_netns(self):
+    def get_state(self):
         """
-        Returns the network namespace (PID) of this container. If the container is
-        not running, returns None.
+        Returns a tuple (container identifier, PID) of this Docker container. If
+        the container is not running, returns None. While configuration is
+        being applied, the state is only obtained from Docker once.
         """
 
+        states = self.config.container_states
+        if states is not None and self.name in states:
+            return states[self.name]
+
         try:
             cfg = self.config.get_docker_client().inspect_container(self.name)
             if not cfg['State']['Running']:
-                return None
-
-            return str(cfg['State']['Pid'])
+                state = None
+            else:
+                state = cfg['Id'], cfg['State']['Pid']
         except:
             # TODO: We should not catch all the exceptions here
+            state = None
+
+        if states is not None:
+            states[self.name] = state
+        return state
+
+    def get_netns(self):
+        """
+        Returns the network namespace (PID) of this container. If the container is
+        not running, returns None.
+        """
+
+        state = self.get_state()
+        if state is None:
             return None
 
-    def serialize(self):
+        return str(state[1])
+
+    def serialize(self, attachments=None, fields=None):
         """
         Prepares configuration so it is suitable for serialization into
         JSON (without complex types).
+
+        :param attachments: Optional subset of attachments to include
+        :param fields: Optional list of network configuration keys to include
         """
 
+        if attachments is None:
+            attachments = self.attachments
+
+        networks = {}
+        for attachment in attachments:
+            netcfg = attachment.config
+            if fields is not None and netcfg is not None:
+                netcfg = {key: value for key, value in netcfg.items() if key in fields}
+            networks[attachment.network.name] = netcfg
+
         return {
             'name': self.name,
-            'networks': {net.name: cfg for net, cfg in self.networks.items()},
+            'networks': networks,
         }
 
     @classmethod
     def deserialize(cls, data, cfg):
         """
         Deserializes configuration from data returned by a previous call to
-        `serialize`.
+        `serialize`. Network configuration is not validated here, so it can
+        be validated for all containers at once by using
+        `Network.validate_attachments`.
 
         :param data: Serialized data returned by `serialize`
         :return: Deserialized Container instance
@@ -74,48 +199,139 @@ class Container(object):
             except KeyError:
                 raise KeyError("Deserialization of container '%s' failed." % container.name)
 
-            container.attach(net, netcfg)
+            container.add_attachment(net, netcfg)
 
         return container
 
-    def attach(self, network, netcfg):
+    def get_attachment(self, network):
+        """
+        Returns the attachment record for the given network or None if the
+        network is not attached to this container.
+
+        :param network: Network instance
+        """
+
+        for attachment in self.attachments:
+            if attachment.network is network:
+                return attachment
+
+        return None
+
+    def attach(self, network, netcfg, apply=True):
         """
         Attaches a network to this container. In case the container is running,
         the configuration is also applied.
 
         :param network: Network to attach
         :param netcfg: Network-specific configuration
+        :param apply: Should the configuration be applied to a running container
         """
 
         network.validate(netcfg)
-        self.networks[network] = netcfg
-        network.attach(self)
+        self.add_attachment(network, netcfg)
+
+        if apply and self.is_running:
+            self.apply_network(network, netcfg)
+
+    def add_attachment(self, network, netcfg):
+        """
+        Records an attachment of a network to this container, replacing any
+        previous attachment of the same network. The configuration is
+        neither validated nor applied.
+
+        :param network: Network to attach
+        :param netcfg: Network-specific configuration
+        :return: Attachment instance
+        """
 
-        if self.is_running:
-            network.apply(self, netcfg)
+        attachment = Attachment(network, netcfg)
+        attachments = [att for att in self.attachments if att.network is not network]
+        attachments.append(attachment)
+        self.attachments = tuple(attachments)
+        network.attach(self)
+        return attachment
 
-    def detach(self, network):
+    def detach(self, network, apply=True):
         """
         Detaches a network from this container. In case the container is running,
         the configuration is also applied.
 
         :param network: Network to detach
+        :param apply: Should the configuration be removed from a running container
         """
 
-        if network not in self.networks:
+        attachment = self.get_attachment(network)
+        if attachment is None:
             raise KeyError("Container '%s' is not attached to network '%s'!" % (self.name, network.name))
 
         network.detach(self)
-        netcfg = self.networks[network]
-        del self.networks[network]
+        netcfg = attachment.config
+        self.attachments = tuple([att for att in self.attachments if att is not attachment])
 
-        if self.is_running:
-            network.apply(self, netcfg, detach=True)
+        if apply and self.is_running:
+            self.apply_network(network, netcfg, detach=True)
 
     def apply(self, detach=False):
         """
         Applies container configuration.
+
+        :param detach: Should the configuration be removed instead
+        :return: True if configuration of all networks has been applied successfully
+        """
+
+        success = True
+        with self.config.cache_container_states():
+            for attachment in self.attachments:
+                if not self.apply_network(attachment.network, attachment.config, detach=detach):
+                    success = False
+
+        return success
+
+    def apply_network(self, network, netcfg, detach=False, wait_ready=None):
         """
+        Applies configuration of a single network to this container and
+        records the outcome in the ledger of applied configuration. When
+        requested, the configuration is then tracked until it becomes usable.
+
+        :param network: Network instance
+        :param netcfg: Network-specific configuration
+        :param detach: Should the configuration be removed instead
+        :param wait_ready: Optional number of seconds to track readiness for
+        :return: True if configuration has been applied successfully
+        """
+
+        with self.config.cache_container_states():
+            success = network.apply(self, netcfg, detach=detach)
+            return self.network_applied(network, netcfg, success, time.time(), detach=detach, wait_ready=wait_ready)
+
+    def network_applied(self, network, netcfg, success, finished, detach=False, wait_ready=None):
+        """
+        Completes applying configuration of a single network, which has
+        either been applied by `apply_network` or together with other
+        containers by `Network.apply_batch`.
+
+        :param network: Network instance
+        :param netcfg: Network-specific configuration
+        :param success: Has the configuration been applied successfully
+        :param finished: Time when the configuration has been applied, from
+          which its readiness is measured
+        :param detach: Has the configuration been removed instead
+        :param wait_ready: Optional number of seconds to track readiness for
+        :return: True if configuration has been applied successfully
+        """
+
+        ledger = self.config.ledger
+        if ledger is not None:
+            if detach:
+                ledger.remove(self, network)
+            elif success:
+                ledger.record(self, network, netcfg)
+
+        readiness = self.config.readiness
+        if readiness is not None:
+            if success and not detach and wait_ready:
+                readiness.add(self, network, netcfg, finished, wait_ready)
+            else:
+                readiness.discard(self, network)
 
-        for network, netcfg in self.networks.items():
-            network.apply(self, netcfg, detach=detach)
+        return success
@@ -1,17 +1,38 @@
+import collections
 import docker
 import json
 import logging
 import os
+import socket
 import threading
 import time
 import traceback
 import zmq
 
 from . import configuration
+from . import ledger
+from . import log
+from . import readiness
+from . import replication
+from . import utils
+from . import verifier
 from .network import base as network_base
 
 logger = logging.getLogger('netcfg.daemon')
 
+# Maximum number of containers returned by a single query
+QUERY_PAGE_SIZE = 500
+
+# Default maximum number of containers with pending Docker events
+MAX_PENDING_EVENTS = 10000
+
+# Default maximum number of pending events applied in one main loop iteration
+APPLY_BATCH = 10
+
+# Default number of seconds events of a container are held back, so that further
+# events arriving shortly after are coalesced into a single apply
+COALESCE_DELAY = 0.5
+
 
 class ErrorResponse(Exception):
     pass
@@ -60,25 +81,178 @@ class DockerSubscriber(threading.Thread):
                 time.sleep(1)
 
 
+class PendingEvents(object):
+    """
+    Bounded table of pending Docker events. Only the latest event is kept for
+    each container, so a storm of events results in a single apply per
+    container. Events only become ready after a coalescing delay measured
+    from the first pending event of each container.
+    """
+
+    def __init__(self, max_size, delay=0, clock=time.time):
+        """
+        Class constructor.
+
+        :param max_size: Maximum number of containers with pending events
+        :param delay: Number of seconds events are held back for coalescing
+        :param clock: Function returning the current time in seconds
+        """
+
+        self.max_size = max_size
+        self.delay = delay
+        self.clock = clock
+        self.events = collections.OrderedDict()
+        self.overflow = False
+        self.received = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.events)
+
+    def add(self, name, status):
+        """
+        Adds an event to the table. When the table is full, the event is
+        dropped and the overflow flag is set.
+
+        :param name: Container name
+        :param status: Event status
+        """
+
+        self.received += 1
+        if name in self.events:
+            # Keep the position in the queue and the time of the first event,
+            # but only the final state
+            self.coalesced += 1
+            self.events[name] = (status, self.events[name][1])
+            return
+        elif len(self.events) >= self.max_size:
+            self.dropped += 1
+            self.overflow = True
+            return
+
+        self.events[name] = (status, self.clock())
+
+    def get_timeout(self):
+        """
+        Returns the number of seconds until the oldest pending event becomes
+        ready, or None when there are no pending events. Events keep their
+        position when coalesced, so the oldest event is always ready first.
+        """
+
+        if not self.events:
+            return None
+
+        _, (_, since) = next(self.events.iteritems())
+        return max(0, since + self.delay - self.clock())
+
+    def is_ready(self):
+        """
+        Returns True if the oldest pending event is ready to be applied.
+        """
+
+        return self.get_timeout() == 0
+
+    def pop(self):
+        """
+        Removes and returns the oldest pending event as a (name, status) tuple.
+        """
+
+        name, (status, _) = self.events.popitem(last=False)
+        return name, status
+
+    def clear(self):
+        """
+        Removes all pending events and resets the overflow flag.
+        """
+
+        self.events.clear()
+        self.overflow = False
+
+    def get_stats(self):
+        """
+        Returns event queue statistics.
+        """
+
+        return {
+            'pending': len(self.events),
+            'received': self.received,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+        }
+
+
 class Daemon(object):
     """
     Netcfg daemon.
     """
 
-    def __init__(self, ipc_socket_path, docker_socket_path, config_path):
+    def __init__(self, ipc_socket_path, docker_socket_path, config_path, events_socket_path=None,
+                 state_path=None, max_pending_events=MAX_PENDING_EVENTS, apply_batch=APPLY_BATCH,
+                 apply_rate=None, coalesce_delay=COALESCE_DELAY, replication_bind=None, replication_leader=None, replication_id=None,
+                 verify_interval=verifier.VERIFY_INTERVAL, verify_budget=verifier.VERIFY_BUDGET,
+                 verify_time_budget=verifier.VERIFY_TIME_BUDGET):
         """
         Class constructor.
 
         :param ipc_socket_path: Path to IPC socket
         :param docker_socket_path: Path to Docker socket
         :param config_path: Path to netcfg configuration
+        :param events_socket_path: Path to change events socket (defaults to
+          the IPC socket path with an '.events' suffix)
+        :param state_path: Path to ledger of applied configuration (defaults to
+          'state.json' in the configuration directory)
+        :param max_pending_events: Maximum number of containers with pending
+          Docker events
+        :param apply_batch: Maximum number of pending events applied before
+          handling other messages
+        :param apply_rate: Optional maximum number of pending events applied
+          per second
+        :param coalesce_delay: Number of seconds events of a container are held
+          back, measured from its first pending event, so that events arriving
+          shortly after are coalesced
+        :param replication_bind: Replication address to bind to when acting as
+          the replication leader (for example 'tcp://*:5560')
+        :param replication_leader: Replication address of the leader when acting
+          as a follower (for example 'tcp://leader:5560')
+        :param replication_id: Follower identifier (defaults to the hostname)
+        :param verify_interval: Number of seconds between checks of applied
+          configuration for drift (0 disables verification)
+        :param verify_budget: Maximum number of containers checked for drift
+          in one verification cycle
+        :param verify_time_budget: Maximum number of seconds spent in one
+          verification cycle
         """
 
+        if replication_bind and replication_leader:
+            raise ValueError('Daemon can not be both a replication leader and a follower.')
+
+        if events_socket_path is None:
+            events_socket_path = '%s.events' % ipc_socket_path
+        if state_path is None:
+            state_path = os.path.join(os.path.dirname(config_path), 'state.json')
+
         self.context = zmq.Context()
         self.ipc_socket_path = ipc_socket_path
+        self.events_socket_path = events_socket_path
+        self.socket_events = None
+        self.epoch = int(time.time() * 1000)
+        self.sequence = 0
+        self.topic_sequences = {}
         self.docker_socket_path = docker_socket_path
         self.config_path = config_path
-        self.config = configuration.Configuration(docker_socket_path)
+        self.ledger = ledger.Ledger(state_path)
+        self.readiness = readiness.ReadinessTracker()
+        self.config = configuration.Configuration(docker_socket_path, ledger=self.ledger, readiness=self.readiness)
+        self.pending_events = PendingEvents(max_pending_events, coalesce_delay)
+        self.apply_batch = apply_batch
+        self.apply_limiter = utils.TokenBucket(apply_rate) if apply_rate else None
+        self.applied_events = 0
+        self.replication_bind = replication_bind
+        self.replication_leader = replication_leader
+        self.replication_id = replication_id or socket.gethostname()
+        self.replication = None
+        self.verifier = verifier.DriftVerifier(verify_interval, verify_budget, verify_time_budget) if verify_interval else None
 
     def start(self):
         """
@@ -98,6 +272,10 @@ class Daemon(object):
         socket_rpc = self.context.socket(zmq.REP)
         socket_rpc.bind('ipc://%s' % self.ipc_socket_path)
 
+        # Bind the change events socket
+        self.socket_events = self.context.socket(zmq.PUB)
+        self.socket_events.bind('ipc://%s' % self.events_socket_path)
+
         # Wait for socket events
         poller = zmq.Poller()
         poller.register(socket_nc, zmq.POLLIN)
@@ -111,32 +289,211 @@ class Daemon(object):
 
         try:
             with open(self.config_path, 'r') as f:
-                self.config.deserialize(json.load(f))
+                self.config.load(f)
         except IOError:
             self.save_config()
 
-        # Attempt to first apply configuration for all running containers
+        # Attempt to first apply configuration for all running containers, skipping
+        # configuration that the ledger shows as already applied
         logger.info("Applying configuration to all running containers.")
+        self.ledger.load()
         self.config.apply()
+        self.ledger.save()
+
+        # Setup configuration replication
+        if self.replication_bind:
+            self.replication = replication.ReplicationLeader(self.context, self.replication_bind, self.epoch)
+        elif self.replication_leader:
+            self.replication = replication.ReplicationFollower(
+                self.context,
+                self.replication_leader,
+                self.replication_id,
+            )
+            self.replication.request_snapshot()
+
+        if self.replication is not None:
+            for sock in self.replication.sockets:
+                poller.register(sock, zmq.POLLIN)
 
         while True:
-            socks = dict(poller.poll())
+            socks = dict(poller.poll(self.get_poll_timeout()))
+
+            if self.replication is not None:
+                for sock in self.replication.sockets:
+                    if sock in socks:
+                        self.replication.process(sock, self)
+                self.replication.tick(self)
+
+            if self.verifier is not None:
+                self.verifier.tick(self)
+
+            self.readiness.tick(self)
 
             if socket_rpc in socks:
                 msg = socket_rpc.recv()
                 socket_rpc.send(self.process_rpc(msg))
 
             if socket_nc in socks:
-                msg = socket_nc.recv()
-                self.process_docker_event(msg)
+                self.receive_docker_events(socket_nc)
+
+            self.drain_events()
+            self.ledger.save()
+
+    def get_poll_timeout(self):
+        """
+        Returns the poll timeout in milliseconds, depending on whether there
+        are pending events that can be applied and on periodic replication,
+        verification and readiness work.
+        """
+
+        timeouts = []
+        if self.pending_events:
+            timeout = self.pending_events.get_timeout()
+            if self.apply_limiter is not None:
+                timeout = max(timeout, self.apply_limiter.delay())
+            timeouts.append(timeout)
+        if self.replication is not None:
+            timeouts.append(self.replication.get_timeout())
+        if self.verifier is not None:
+            timeouts.append(self.verifier.get_timeout())
+        timeouts.append(self.readiness.get_timeout())
+
+        timeouts = [timeout for timeout in timeouts if timeout is not None]
+        if not timeouts:
+            return None
+
+        return int(min(timeouts) * 1000)
 
     def save_config(self):
         """
         Saves current configuration.
         """
 
-        with open(self.config_path, 'w') as f:
-            json.dump(self.config.serialize(), f)
+        tmp_path = '%s.tmp' % self.config_path
+        with open(tmp_path, 'w') as f:
+            self.config.dump(f)
+        os.rename(tmp_path, self.config_path)
+
+    def publish(self, event, **kwargs):
+        """
+        Publishes a change event to subscribers. Every event carries the
+        daemon epoch, a sequence number and a sequence number among events
+        of the same type, so subscribers are able to detect missed events and
+        daemon restarts even when subscribed only to some event types.
+
+        :param event: Event type
+        """
+
+        if self.socket_events is None:
+            return
+
+        self.sequence += 1
+        self.topic_sequences[event] = self.topic_sequences.get(event, 0) + 1
+        kwargs['event'] = event
+        kwargs['epoch'] = self.epoch
+        kwargs['seq'] = self.sequence
+        kwargs['topic_seq'] = self.topic_sequences[event]
+        self.socket_events.send_multipart([event, json.dumps(kwargs)])
+
+    def apply_container(self, container, detach=False, network=None, netcfg=None, wait_ready=None):
+        """
+        Applies configuration of a running container and publishes the
+        outcome.
+
+        :param container: Container instance
+        :param detach: Should the configuration be removed instead
+        :param network: Only apply configuration of this network
+        :param netcfg: Configuration of the network
+        :param wait_ready: Optional number of seconds to track readiness of
+          the network configuration for
+        :return: True if configuration has been applied successfully
+        """
+
+        try:
+            if network is None:
+                success = container.apply(detach=detach)
+            else:
+                success = container.apply_network(network, netcfg, detach=detach, wait_ready=wait_ready)
+        except:
+            logger.error("Exception raised while applying configuration to container '%s':", container.name)
+            logger.error(traceback.format_exc())
+            success = False
+
+        event = {
+            'container': container.name,
+            'detach': detach,
+        }
+        if network is not None:
+            event['network'] = network.name
+
+        self.publish('container_applied' if success else 'container_failed', **event)
+        return success
+
+    def apply_containers(self, containers):
+        """
+        Applies configuration of many started containers at once, so that
+        networks supporting batch apply are configured in one pass, and
+        publishes the outcome for each container.
+
+        :param containers: List of container instances
+        """
+
+        try:
+            results = self.config.apply_containers(containers)
+        except:
+            logger.error("Exception raised while applying configuration to %d containers:", len(containers))
+            logger.error(traceback.format_exc())
+            results = {}
+
+        self.publish_results([container.name for container in containers], results)
+
+    def apply_all(self):
+        """
+        Applies configuration to all running containers and publishes the
+        outcome for each of them.
+        """
+
+        try:
+            results = self.config.apply()
+        except:
+            logger.error("Exception raised while applying configuration to all running containers:")
+            logger.error(traceback.format_exc())
+            results = {}
+
+        self.publish_results(sorted(results), results)
+
+    def publish_results(self, names, results):
+        """
+        Publishes the outcome of applying configuration to many containers.
+
+        :param names: Names of containers
+        :param results: Dictionary mapping container names to True if their
+          configuration has been applied successfully
+        """
+
+        for name in names:
+            self.publish(
+                'container_applied' if results.get(name) else 'container_failed',
+                container=name,
+                detach=False,
+            )
+
+    def receive_docker_events(self, socket):
+        """
+        Receives all Docker events queued on the subscriber socket, so that
+        events for the same container are coalesced before any of them are
+        applied.
+
+        :param socket: Docker subscriber socket
+        """
+
+        for _ in xrange(max(self.pending_events.max_size, 1)):
+            try:
+                msg = socket.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+
+            self.process_docker_event(msg)
 
     def process_docker_event(self, msg):
         """
@@ -149,25 +506,60 @@ class Daemon(object):
         container_id = msg['container']['Name'][1:]
         status = msg['status']
 
-        logger.info("Got docker event '%s' for container '%s'." % (msg['status'], container_id))
+        logger.info("Got docker event '%s' for container '%s'.", status, container_id)
 
-        try:
-            container = self.config.get_container(container_id)
-        except KeyError:
+        if container_id not in self.config.containers:
             # Skip containers that have no network configuration in netcfg
-            logger.info("No network configuration found for container '%s'." % container_id)
+            logger.info("No network configuration found for container '%s'.", container_id)
+            return
+
+        # Events are applied later, so that only the final state of each container
+        # is applied when many events arrive at once
+        self.pending_events.add(container_id, status)
+
+    def drain_events(self):
+        """
+        Applies pending Docker events, limited by the configured batch size
+        and rate. Containers started within the batch are applied together.
+        """
+
+        if self.pending_events.overflow:
+            # Some events have been dropped, so reconcile all running containers
+            logger.warning("Pending events table overflow, applying configuration to all running containers.")
+            self.pending_events.clear()
+            self.apply_all()
             return
 
-        if status == 'start':
-            container.apply()
-        elif status == 'stop':
-            container.apply(detach=True)
+        started = []
+        for _ in xrange(self.apply_batch):
+            if not self.pending_events or not self.pending_events.is_ready():
+                break
+            if self.apply_limiter is not None and not self.apply_limiter.consume():
+                break
+
+            container_id, status = self.pending_events.pop()
+            try:
+                container = self.config.get_container(container_id)
+            except KeyError:
+                # Configuration has been removed in the meantime
+                continue
+
+            if status == 'start':
+                started.append(container)
+            elif status == 'stop':
+                self.apply_container(container, detach=True)
+
+            self.applied_events += 1
 
-    def process_rpc(self, msg):
+        if started:
+            self.apply_containers(started)
+
+    def process_rpc(self, msg, replicated=False):
         """
         Processes a remote procedure call from netcfg CLI.
 
         :param msg: JSON serialized RPC message
+        :param replicated: Is the call a delta received from the replication leader
         :return: JSON serialized RPC response
         """
 
@@ -176,11 +568,16 @@ class Daemon(object):
             if 'method' not in msg:
                 raise ValueError
 
+            is_follower = isinstance(self.replication, replication.ReplicationFollower)
+            if msg['method'] in replication.REPLICATED_METHODS and is_follower and not replicated:
+                raise ErrorResponse('Configuration is managed by the replication leader.')
+
             if msg['method'] == 'flush':
                 logger.info("Flushing all network configuration.")
 
                 self.config.flush()
                 self.save_config()
+                self.publish('flush')
 
                 response = {'success': 'Configuration flushed.'}
             elif msg['method'] == 'create_network':
@@ -198,6 +595,7 @@ class Daemon(object):
 
                 if created:
                     self.save_config()
+                    self.publish('network_created', network=net.serialize())
                     response = {
                         'success': 'Network created.',
                         'network': net.serialize(),
@@ -212,6 +610,12 @@ class Daemon(object):
                 network_id = msg['network']
                 net_cfg = msg.get('config', {})
 
+                # Readiness is only tracked for this apply and is not part of the configuration
+                wait_ready = msg.get('wait_ready')
+                if wait_ready is not None and (not isinstance(wait_ready, (int, float)) or isinstance(wait_ready, bool) or
+                                               not 0 <= wait_ready <= readiness.MAX_WAIT_READY):
+                    raise ErrorResponse('Ready timeout must be between 0 and %d seconds.' % readiness.MAX_WAIT_READY)
+
                 # Obtain the network
                 try:
                     net = self.config.get_network(network_id)
@@ -221,14 +625,28 @@ class Daemon(object):
                 # Obtain or create the container
                 container = self.config.add_container(container_id)
                 try:
-                    container.attach(net, net_cfg)
+                    container.attach(net, net_cfg, apply=False)
                     self.save_config()
                 except network_base.NetworkConfigurationError, e:
                     raise ErrorResponse('Network configuration error: ' + e.message)
 
+                self.publish('attach', container=container.name, network=net.name, config=net_cfg)
+
                 response = {
                     'success': 'Network attached.',
+                    'container': container.name,
+                    'network': net.name,
                 }
+
+                # Apply to a running container and publish the outcome, readiness
+                # of addresses is published later as a network_ready event
+                if container.is_running:
+                    response['applied'] = self.apply_container(
+                        container,
+                        network=net,
+                        netcfg=container.get_attachment(net).config,
+                        wait_ready=wait_ready,
+                    )
             elif msg['method'] == 'detach':
                 container_id = msg['container']
                 network_id = msg['network']
@@ -245,25 +663,118 @@ class Daemon(object):
                 except KeyError:
                     raise ErrorResponse('Container does not exist.')
 
+                attachment = container.get_attachment(net)
                 try:
-                    container.detach(net)
+                    container.detach(net, apply=False)
                     self.save_config()
                 except KeyError, e:
                     raise ErrorResponse(e.message)
 
+                self.publish('detach', container=container.name, network=net.name)
+
                 response = {
                     'success': 'Network detached.',
                 }
+
+                # Remove from a running container and publish the outcome
+                if container.is_running:
+                    response['applied'] = self.apply_container(
+                        container,
+                        detach=True,
+                        network=net,
+                        netcfg=attachment.config,
+                    )
             elif msg['method'] == 'get_config':
                 response = {
                     'config': self.config.serialize(),
+                    'epoch': self.epoch,
+                    'seq': self.sequence,
+                    'topic_seqs': self.topic_sequences,
+                }
+            elif msg['method'] == 'get_stats':
+                events = self.pending_events.get_stats()
+                events['applied'] = self.applied_events
+
+                response = {
+                    'stats': {
+                        'events': events,
+                        'log': log.get_stats(),
+                        'replication': self.replication.get_stats() if self.replication is not None else None,
+                        'drift': self.verifier.get_stats() if self.verifier is not None else None,
+                        'readiness': self.readiness.get_stats(),
+                    },
+                }
+            elif msg['method'] == 'get_readiness':
+                response = {
+                    'readiness': self.readiness.get_status(msg['container'], msg['network']),
+                }
+            elif msg['method'] == 'query':
+                limit = msg.get('limit')
+                if limit is None:
+                    limit = QUERY_PAGE_SIZE
+                limit = min(int(limit), QUERY_PAGE_SIZE)
+                if limit < 1:
+                    raise ValueError
+
+                try:
+                    config, cursor = self.config.query(
+                        network=msg.get('network'),
+                        container=msg.get('container'),
+                        address=msg.get('address'),
+                        fields=msg.get('fields'),
+                        cursor=msg.get('cursor'),
+                        limit=limit,
+                    )
+                except KeyError:
+                    raise ErrorResponse('Network does not exist.')
+                except ValueError:
+                    raise ErrorResponse('Invalid address filter.')
+
+                response = {
+                    'config': config,
+                    'cursor': cursor,
                 }
             elif msg['method'] == 'set_config':
                 if 'config' not in msg or not isinstance(msg['config'], dict):
                     raise ValueError
 
-                self.config = configuration.Configuration.deserialize(msg['config'])
+                # Prepare and validate the new configuration without touching the live one
+                new_config = configuration.Configuration(self.docker_socket_path, ledger=self.ledger, readiness=self.readiness)
+                try:
+                    new_config.deserialize(msg['config'])
+                except network_base.NetworkConfigurationError, e:
+                    raise ErrorResponse('Network configuration error: %s' % e.message)
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    raise ErrorResponse('Invalid configuration.')
+
+                # Apply only the difference to running containers. Any failure rejects
+                # the new configuration, except for configuration replicated from the
+                # leader, which is kept even when some local containers fail
+                added, removed, changed = self.config.diff_networks(new_config)
+                changes = self.config.diff(new_config)
+                try:
+                    failed = self.config.apply_changes(changes, atomic=not replicated)
+                except configuration.ConfigurationApplyError, e:
+                    raise ErrorResponse('Error applying configuration: %s' % e.message)
+
+                self.config = new_config
                 self.save_config()
+
+                summary = {
+                    'networks': {
+                        'added': sorted(added),
+                        'removed': sorted(removed),
+                        'changed': sorted(changed),
+                    },
+                    'containers': sorted([change.name for change in changes]),
+                    'failed': [{'container': ctr, 'network': net} for ctr, net in sorted(failed)],
+                }
+                self.publish('set_config', changes=summary)
+
+                response = {
+                    'success': 'Configuration replaced.',
+                    'changes': summary,
+                }
             else:
                 response = {
                     'error': 'Unknown method \'%s\'.' % msg['method']
@@ -277,4 +788,8 @@ class Daemon(object):
                 'error': e.message,
             }
 
+        is_leader = isinstance(self.replication, replication.ReplicationLeader)
+        if is_leader and 'success' in response and msg['method'] in replication.REPLICATED_METHODS:
+            self.replication.publish(msg)
+
         return json.dumps(response)
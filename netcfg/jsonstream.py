@@ -0,0 +1,154 @@
+import json
+import types
+
+# Number of bytes read from the file at once
+CHUNK_SIZE = 65536
+
+
+class JSONStreamReader(object):
+    """
+    Incremental reader of large JSON objects. Members of selected nested
+    objects are decoded one at a time, so the complete document never has
+    to be held in memory.
+    """
+
+    def __init__(self, fp, chunk_size=CHUNK_SIZE):
+        """
+        Class constructor.
+
+        :param fp: File-like object to read from
+        :param chunk_size: Number of bytes read at once
+        """
+
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """
+        Reads the next chunk into the buffer.
+
+        :return: False when the end of file has been reached
+        """
+
+        if self.eof:
+            return False
+
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        Skips whitespace and returns the next character without consuming
+        it. Returns an empty string at the end of file.
+        """
+
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, chars):
+        """
+        Consumes the next character, which must be one of the given ones.
+
+        :param chars: Allowed characters
+        :return: The consumed character
+        """
+
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError("Expected one of '%s' at offset %d." % (chars, self.pos))
+
+        self.pos += 1
+        return char
+
+    def decode(self):
+        """
+        Decodes the next complete JSON value.
+        """
+
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                # The value may be incomplete, so read more data and retry
+                if not self.fill():
+                    raise
+                continue
+
+            # A value that ends with the buffer (a number) may continue in the next chunk
+            if end == len(self.buffer) and self.fill():
+                continue
+
+            self.pos = end
+            return value
+
+    def iter_object(self, nested=()):
+        """
+        Generator that yields (key, value) pairs of the next JSON object. For
+        keys listed in `nested`, the value is itself a generator of (key, value)
+        pairs of the nested object.
+
+        :param nested: Keys of nested objects that should also be streamed
+        """
+
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+
+        while True:
+            key = self.decode()
+            self.expect(':')
+
+            if key in nested:
+                members = self.iter_object()
+                yield key, members
+
+                # Skip any members the consumer did not read
+                for _ in members:
+                    pass
+            else:
+                yield key, self.decode()
+
+            if self.expect(',}') == '}':
+                return
+
+
+def dump_object(fp, items):
+    """
+    Writes a JSON object member by member. Values that are generators of
+    (key, value) pairs are written incrementally as nested objects.
+
+    :param fp: File-like object to write to
+    :param items: Iterable of (key, value) pairs
+    """
+
+    fp.write('{')
+    first = True
+    for key, value in items:
+        if not first:
+            fp.write(', ')
+        first = False
+
+        fp.write(json.dumps(key))
+        fp.write(': ')
+        if isinstance(value, types.GeneratorType):
+            dump_object(fp, value)
+        else:
+            fp.write(json.dumps(value))
+
+    fp.write('}')
@@ -0,0 +1,205 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger('netcfg.ledger')
+
+# Minimum number of journal entries before the journal is compacted
+COMPACT_MIN_ENTRIES = 1000
+
+
+class Ledger(object):
+    """
+    Persistent record of network configuration that has actually been applied
+    to running containers.
+
+    The ledger is stored as a snapshot of all records and a journal, to which
+    the records of modified containers are appended. Saving therefore only
+    costs as much as the number of modified containers. The journal is folded
+    into the snapshot once it has grown larger than the snapshot itself.
+    """
+
+    def __init__(self, path, compact_min_entries=COMPACT_MIN_ENTRIES):
+        """
+        Class constructor.
+
+        :param path: Path to ledger file
+        :param compact_min_entries: Minimum number of journal entries before
+          the journal is compacted
+        """
+
+        self.path = path
+        self.journal_path = '%s.journal' % path
+        self.compact_min_entries = compact_min_entries
+        self.records = {}
+        self.modified = set()
+        self.journal_entries = 0
+
+    def load(self):
+        """
+        Loads the ledger from disk. A missing or corrupted ledger is treated
+        as empty, which causes configuration to be applied again.
+        """
+
+        try:
+            with open(self.path, 'r') as f:
+                self.records = json.loads(f.read())
+        except IOError:
+            self.records = {}
+        except ValueError:
+            logger.warning("Ignoring corrupted ledger '%s'.", self.path)
+            self.records = {}
+
+        # Replay records of containers modified after the snapshot was written
+        self.journal_entries = 0
+        try:
+            with open(self.journal_path, 'r') as f:
+                for line in f:
+                    try:
+                        name, entry = json.loads(line)
+                    except ValueError:
+                        # Only the last entry can be incomplete, when the daemon was
+                        # stopped while appending it
+                        logger.warning("Ignoring corrupted entry in ledger journal '%s'.", self.journal_path)
+                        continue
+
+                    if entry is None:
+                        self.records.pop(name, None)
+                    else:
+                        self.records[name] = entry
+                    self.journal_entries += 1
+        except IOError:
+            pass
+
+        self.modified = set()
+
+    def save(self):
+        """
+        Appends records of modified containers to the journal, compacting
+        it into the snapshot when it has grown too large.
+        """
+
+        if not self.modified:
+            return
+
+        if self.journal_entries + len(self.modified) > max(self.compact_min_entries, len(self.records)):
+            self.compact()
+            return
+
+        lines = [json.dumps([name, self.records.get(name)]) for name in self.modified]
+        with open(self.journal_path, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+        self.journal_entries += len(lines)
+        self.modified = set()
+
+    def compact(self):
+        """
+        Writes a snapshot of all records and empties the journal.
+        """
+
+        tmp_path = '%s.tmp' % self.path
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps(self.records))
+        os.rename(tmp_path, self.path)
+
+        # Replaying entries over the new snapshot is harmless, so a crash before
+        # the journal is emptied does not lose anything
+        with open(self.journal_path, 'w'):
+            pass
+        self.journal_entries = 0
+        self.modified = set()
+
+    def get_netns_inode(self, pid):
+        """
+        Returns the inode of the network namespace of a process or None if
+        the process does not exist.
+
+        :param pid: Process identifier
+        """
+
+        try:
+            return os.stat(os.path.join('/proc', str(pid), 'ns/net')).st_ino
+        except OSError:
+            return None
+
+    def record(self, container, network, netcfg):
+        """
+        Records that network configuration has been applied to a container.
+
+        :param container: Container instance
+        :param network: Network instance
+        :param netcfg: Applied network-specific configuration
+        """
+
+        state = container.get_state()
+        if state is None:
+            return
+
+        container_id, pid = state
+        netns = self.get_netns_inode(pid)
+        entry = self.records.get(container.name)
+        if entry is None or entry['id'] != container_id or entry['netns'] != netns:
+            # Container has been restarted, previous entries are no longer valid
+            entry = {
+                'id': container_id,
+                'pid': pid,
+                'netns': netns,
+                'networks': {},
+            }
+            self.records[container.name] = entry
+
+        entry['networks'][network.name] = {
+            'network': network.serialize(),
+            'config': netcfg,
+            'interfaces': network.get_interfaces(container, str(pid)),
+        }
+        self.modified.add(container.name)
+
+    def remove(self, container, network):
+        """
+        Records that network configuration has been removed from a container.
+
+        :param container: Container instance
+        :param network: Network instance
+        """
+
+        entry = self.records.get(container.name)
+        if entry is None or network.name not in entry['networks']:
+            return
+
+        del entry['networks'][network.name]
+        if not entry['networks']:
+            del self.records[container.name]
+        self.modified.add(container.name)
+
+    def get_applied(self, name, container_id):
+        """
+        Returns networks applied to a running container, provided that the
+        container still uses the same network namespace as when they were
+        applied. Otherwise returns None.
+
+        :param name: Container name
+        :param container_id: Identifier of the running container
+        :return: Dictionary mapping network names to applied entries or None
+        """
+
+        entry = self.records.get(name)
+        if entry is None or entry['id'] != container_id:
+            return None
+
+        if self.get_netns_inode(entry['pid']) != entry['netns']:
+            return None
+
+        return entry['networks']
+
+    def prune(self, running):
+        """
+        Removes records of containers that are no longer running.
+
+        :param running: Set of identifiers of running containers
+        """
+
+        for name, entry in self.records.items():
+            if entry['id'] not in running:
+                del self.records[name]
+                self.modified.add(name)
@@ -0,0 +1,199 @@
+import logging
+import Queue
+import threading
+import time
+
+from . import utils
+
+# Maximum number of distinct message keys tracked for rate limiting
+MAX_RATE_LIMIT_KEYS = 10000
+
+# Interval in seconds between reports of dropped log records
+DROPPED_REPORT_INTERVAL = 60
+
+
+class QueueHandler(logging.Handler):
+    """
+    Logging handler that hands records off to a bounded queue, so that
+    logging never blocks the caller. Messages are formatted later by the
+    `QueueListener` thread.
+
+    Records below the warning level are rate limited per message key (logger
+    name and message template). Once the limit of a key is exceeded, only
+    every n-th record is sampled.
+    """
+
+    def __init__(self, queue, rate=10, burst=None, sample=100):
+        """
+        Class constructor.
+
+        :param queue: Bounded queue instance
+        :param rate: Number of records per second allowed for each message key
+        :param burst: Number of records allowed in a burst for each message key
+        :param sample: Pass every n-th record over the rate limit (0 disables sampling)
+        """
+
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.rate = rate
+        self.burst = burst
+        self.sample = sample
+        self.limiters = {}
+        self.dropped = 0
+        self.suppressed = 0
+
+    def is_allowed(self, record):
+        """
+        Checks whether a record is within the rate limit of its message key.
+
+        :param record: Log record
+        """
+
+        if not self.rate or record.levelno >= logging.WARNING:
+            return True
+
+        key = (record.name, record.msg)
+        limiter = self.limiters.get(key)
+        if limiter is None:
+            if len(self.limiters) >= MAX_RATE_LIMIT_KEYS:
+                self.limiters.clear()
+
+            limiter = self.limiters[key] = [utils.TokenBucket(self.rate, self.burst), 0]
+
+        if limiter[0].consume():
+            return True
+
+        limiter[1] += 1
+        if self.sample and limiter[1] % self.sample == 0:
+            return True
+
+        self.suppressed += 1
+        return False
+
+    def emit(self, record):
+        """
+        Enqueues a record without formatting it.
+
+        :param record: Log record
+        """
+
+        try:
+            if not self.is_allowed(record):
+                return
+
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+        except:
+            self.handleError(record)
+
+    def get_stats(self):
+        """
+        Returns logging statistics.
+        """
+
+        return {
+            'queued': self.queue.qsize(),
+            'dropped': self.dropped,
+            'suppressed': self.suppressed,
+        }
+
+
+class QueueListener(threading.Thread):
+    """
+    Thread that formats records from the queue and passes them on to the
+    target handler.
+    """
+
+    def __init__(self, queue, handler, queue_handler):
+        """
+        Class constructor.
+
+        :param queue: Queue with log records
+        :param handler: Target handler
+        :param queue_handler: `QueueHandler` instance feeding the queue
+        """
+
+        self.queue = queue
+        self.handler = handler
+        self.queue_handler = queue_handler
+        super(QueueListener, self).__init__()
+        self.daemon = True
+
+    def report_dropped(self, dropped, suppressed):
+        """
+        Logs the number of records dropped since the last report.
+        """
+
+        record = logging.LogRecord(
+            'netcfg.log',
+            logging.WARNING,
+            __file__,
+            0,
+            "Dropped %d log records because the log queue was full and suppressed %d rate limited records.",
+            (dropped, suppressed),
+            None,
+        )
+        self.handler.handle(record)
+
+    def run(self):
+        """
+        Thread entry point.
+        """
+
+        reported = (0, 0)
+        last_report = time.time()
+        while True:
+            try:
+                record = self.queue.get(timeout=DROPPED_REPORT_INTERVAL)
+            except Queue.Empty:
+                record = None
+
+            if record is not None:
+                try:
+                    self.handler.handle(record)
+                except:
+                    self.handler.handleError(record)
+
+            if time.time() - last_report >= DROPPED_REPORT_INTERVAL:
+                current = (self.queue_handler.dropped, self.queue_handler.suppressed)
+                if current != reported:
+                    self.report_dropped(current[0] - reported[0], current[1] - reported[1])
+                    reported = current
+                last_report = time.time()
+
+
+def setup_queue_logging(logger, handler, queue_size=10000, rate=10, burst=None, sample=100):
+    """
+    Attaches a non-blocking queue handler to a logger, forwarding records to
+    the given handler in a background thread.
+
+    :param logger: Logger instance
+    :param handler: Target handler
+    :param queue_size: Maximum number of queued records
+    :param rate: Number of records per second allowed for each message key
+    :param burst: Number of records allowed in a burst for each message key
+    :param sample: Pass every n-th record over the rate limit
+    :return: `QueueHandler` instance
+    """
+
+    queue = Queue.Queue(maxsize=queue_size)
+    queue_handler = QueueHandler(queue, rate=rate, burst=burst, sample=sample)
+    logger.addHandler(queue_handler)
+    QueueListener(queue, handler, queue_handler).start()
+    return queue_handler
+
+
+def get_stats(logger_name='netcfg'):
+    """
+    Returns statistics of the queue handler attached to a logger or None
+    when queue logging is not used.
+
+    :param logger_name: Logger name
+    """
+
+    for handler in logging.getLogger(logger_name).handlers:
+        if isinstance(handler, QueueHandler):
+            return handler.get_stats()
+
+    return None
@@ -0,0 +1,211 @@
+import gc
+import json
+import os
+import StringIO
+import traceback
+
+from . import configuration
+
+
+class LegacyNetwork(object):
+    """
+    Network in the object model used before compact records, only kept to
+    measure how much memory the compact records save.
+    """
+
+    def __init__(self, name, destroy_on_stop=False):
+        self.name = name
+        self.destroy_on_stop = destroy_on_stop
+        self.containers = set()
+
+
+class LegacyContainer(object):
+    """
+    Container in the object model used before compact records, which kept
+    decoded network configuration in a dictionary per container.
+    """
+
+    def __init__(self, config, name):
+        self.config = config
+        self.name = name
+        self.networks = {}
+
+
+def get_rss():
+    """
+    Returns the resident set size of the current process in bytes.
+    """
+
+    with open('/proc/self/status', 'r') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+
+    return 0
+
+
+def generate(networks, containers, prefix='mbench'):
+    """
+    Returns serialized configuration of synthetic containers, each of them
+    attached to one network with one address.
+
+    :param networks: Number of networks
+    :param containers: Number of containers
+    :param prefix: Prefix of network and container names
+    """
+
+    data = {'networks': {}, 'containers': {}}
+    for index in xrange(networks):
+        name = '%s%d' % (prefix, index)
+        data['networks'][name] = {'name': name, 'type': 'bridge', 'destroy_on_stop': False}
+
+    for index in xrange(containers):
+        name = '%s-%d' % (prefix, index)
+        data['containers'][name] = {
+            'name': name,
+            'networks': {
+                '%s%d' % (prefix, index % networks): {
+                    'address': ['10.%d.%d.%d/8' % (index >> 16 & 255, index >> 8 & 255, index & 255)],
+                    'dad': 'optimistic',
+                },
+            },
+        }
+
+    return json.dumps(data)
+
+
+def run_isolated(function, *args):
+    """
+    Runs a measurement in a forked process, so that memory released by
+    previous measurements does not influence it.
+
+    :return: Value returned by the function
+    """
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            result = function(*args)
+        except:
+            traceback.print_exc()
+            result = None
+        os.write(write_fd, json.dumps(result))
+        os._exit(0)
+
+    os.close(write_fd)
+    chunks = []
+    while True:
+        chunk = os.read(read_fd, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+
+    result = json.loads(''.join(chunks))
+    if result is None:
+        raise RuntimeError('Memory measurement failed.')
+
+    return result
+
+
+def measure_dict(document):
+    """
+    Returns the memory used by configuration kept as decoded JSON.
+    """
+
+    gc.collect()
+    before = get_rss()
+    data = json.loads(document)
+    gc.collect()
+    return get_rss() - before
+
+
+def measure_legacy(document):
+    """
+    Returns the memory used by configuration loaded into the object model
+    used before compact records.
+    """
+
+    gc.collect()
+    before = get_rss()
+    data = json.loads(document)
+    networks = {}
+    for name, netcfg in data['networks'].items():
+        networks[name] = LegacyNetwork(netcfg['name'], netcfg['destroy_on_stop'])
+
+    containers = {}
+    for name, ctrcfg in data['containers'].items():
+        ctr = containers[name] = LegacyContainer(None, ctrcfg['name'])
+        for netname, netcfg in ctrcfg['networks'].items():
+            ctr.networks[networks[netname]] = netcfg
+            networks[netname].containers.add(ctr)
+
+    del data
+    gc.collect()
+    return get_rss() - before
+
+
+def measure_config(document):
+    """
+    Returns the memory used by a loaded `Configuration`.
+    """
+
+    gc.collect()
+    before = get_rss()
+    config = configuration.Configuration('/var/run/docker.sock')
+    config.load(StringIO.StringIO(document))
+    gc.collect()
+    return get_rss() - before
+
+
+def measure_churn(networks, containers, rounds):
+    """
+    Repeatedly loads and flushes configuration that uses different container
+    names each time. The resident set size keeps the high-water mark of the
+    allocator after the first rounds, so only continued growth over later
+    rounds indicates a leak.
+
+    :return: A tuple (list of resident set sizes after each round, number
+      of objects tracked by the garbage collector that were added since the
+      first round)
+    """
+
+    config = configuration.Configuration('/var/run/docker.sock')
+    sizes = []
+    objects = None
+    for index in xrange(rounds + 1):
+        config.load(StringIO.StringIO(generate(networks, containers, prefix='mchurn%d' % index)))
+        config.flush()
+        gc.collect()
+        sizes.append(get_rss())
+        if objects is None:
+            objects = len(gc.get_objects())
+
+    return sizes, len(gc.get_objects()) - objects
+
+
+def run(networks=10, containers=100000, rounds=5):
+    """
+    Measures memory used by configuration of synthetic containers and
+    returns a report.
+
+    :param networks: Number of networks
+    :param containers: Number of containers
+    :param rounds: Number of configuration replacements to detect leaks
+    """
+
+    document = generate(networks, containers)
+    as_dict = run_isolated(measure_dict, document)
+    as_legacy = run_isolated(measure_legacy, document)
+    as_config = run_isolated(measure_config, document)
+    sizes, objects = run_isolated(measure_churn, networks, containers, rounds)
+
+    lines = ['%-24s %12s %12s' % ('representation', 'total KiB', 'B/container')]
+    for name, used in (('decoded JSON', as_dict), ('previous object model', as_legacy), ('configuration', as_config)):
+        lines.append('%-24s %12d %12d' % (name, used / 1024, used / containers))
+    lines.append('RSS after each load/flush round: %s MiB' % ' '.join(['%d' % (size >> 20) for size in sizes]))
+    lines.append('objects added after the first round: %d' % objects)
+    return '\n'.join(lines)
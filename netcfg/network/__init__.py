@@ -1,15 +1,82 @@
+import importlib
+import logging
 
-from . import bridge
+from . import base
+
+logger = logging.getLogger('netcfg.network')
+
+# Entry point group under which packages register network types
+ENTRY_POINT_GROUP = 'netcfg.networks'
+
+# Network types shipped with netcfg, also available when package metadata is not
+# installed or can not be scanned
+BUILTIN_TYPES = {
+    'bridge': 'netcfg.network.bridge:BridgeNetwork',
+}
+
+# Registered network types, discovered on first use
+_types = None
+
+# Network classes that have already been imported
+_classes = {}
+
+
+def get_types():
+    """
+    Returns a dictionary mapping all registered network types to their entry
+    points. Network modules are not imported, but package metadata is
+    scanned for entry points on first use.
+    """
+
+    global _types
+    if _types is not None:
+        return _types
+
+    _types = dict(BUILTIN_TYPES)
+    try:
+        import pkg_resources
+    except ImportError:
+        return _types
+
+    for entry_point in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP):
+        # Built-in types can not be replaced
+        if entry_point.name not in _types:
+            _types[entry_point.name] = entry_point
+
+    return _types
 
 
 def get_class_for_type(network_type):
     """
-    Returns a network class based on a given type string.
+    Returns a network class based on a given type string. The module
+    implementing the network type is imported on first use. Entry points
+    are only scanned for types that are not built in.
 
     :param network_type: Network type string
     """
 
-    if network_type == 'bridge':
-        return bridge.BridgeNetwork
+    net_cls = _classes.get(network_type)
+    if net_cls is not None:
+        return net_cls
+
+    entry_point = BUILTIN_TYPES.get(network_type)
+    if entry_point is None:
+        entry_point = get_types().get(network_type)
+    if entry_point is None:
+        raise ValueError("Network type '%s' is not supported." % network_type)
+
+    try:
+        if isinstance(entry_point, basestring):
+            module_name, class_name = entry_point.split(':')
+            net_cls = getattr(importlib.import_module(module_name), class_name)
+        else:
+            net_cls = entry_point.load()
+    except Exception:
+        logger.exception("Failed to load network type '%s'.", network_type)
+        raise ValueError("Network type '%s' could not be loaded." % network_type)
+
+    if not isinstance(net_cls, type) or not issubclass(net_cls, base.Network):
+        raise ValueError("Network type '%s' is not a network implementation." % network_type)
 
-    raise ValueError("Network type '%s' is not supported." % network_type)
+    _classes[network_type] = net_cls
+    return net_cls
@@ -1,17 +1,74 @@
+import bisect
 import contextlib
 import os
 import subprocess
+import time
+
+from .. import utils
 
 
 class NetworkConfigurationError(Exception):
     pass
 
 
+@contextlib.contextmanager
+def namespace_link(netns):
+    """
+    Context manager that makes the network namespace of a process available
+    to `ip netns` under the process identifier.
+
+    :param netns: Network namespace (PID)
+    """
+
+    netns_dir = '/var/run/netns'
+
+    try:
+        os.makedirs(netns_dir)
+    except OSError:
+        pass
+
+    try:
+        os.unlink(os.path.join(netns_dir, netns))
+    except OSError:
+        pass
+
+    try:
+        os.symlink(os.path.join('/proc', netns, 'ns/net'), os.path.join(netns_dir, netns))
+    except OSError:
+        pass
+
+    try:
+        yield netns
+    finally:
+        # Cleanup network namespace
+        try:
+            os.unlink(os.path.join(netns_dir, netns))
+        except OSError:
+            pass
+
+
 class Network(object):
     """
-    Base class for network implementations.
+    Base class for network implementations. Subclasses should declare
+    `__slots__` as well, so instances do not carry a `__dict__`.
+
+    Network types are registered under the `netcfg.networks` entry point
+    group. Capabilities of a network type are advertised by the class
+    attributes below, so faster code paths can be used where available.
     """
 
+    # Attached containers are not referenced by the network, their attachments
+    # already record the relation; only a sorted index of their names is kept
+    # once it is needed for queries
+    __slots__ = ('name', 'destroy_on_stop', 'container_names')
+
+    # Configuration of many containers can be applied at once by `apply_batch`
+    supports_batch_apply = False
+
+    # Applied configuration can be compared with the kernel state by `verify`,
+    # so configuration recorded in the ledger is not applied again
+    supports_reconcile = False
+
     def __init__(self, name, destroy_on_stop=False):
         """
         Class constructor.
@@ -19,9 +76,9 @@ class Network(object):
         :param name: Network name
         """
 
-        self.name = name
+        self.name = utils.intern_string(name)
         self.destroy_on_stop = destroy_on_stop
-        self.containers = set()
+        self.container_names = None
 
     def serialize(self):
         """
@@ -35,6 +92,19 @@ class Network(object):
             'destroy_on_stop': self.destroy_on_stop,
         }
 
+    def get_applied_config(self):
+        """
+        Returns the part of serialized configuration that affects
+        configuration applied to containers. Changes of other fields, like
+        `destroy_on_stop`, do not require attached containers to be
+        configured again. Subclasses with additional fields that affect
+        applied configuration should include them.
+        """
+
+        config = self.serialize()
+        del config['destroy_on_stop']
+        return config
+
     @classmethod
     def deserialize(cls, data):
         """
@@ -57,7 +127,11 @@ class Network(object):
         :param container: Container instance to attach
         """
 
-        self.containers.add(container)
+        names = self.container_names
+        if names is not None:
+            index = bisect.bisect_left(names, container.name)
+            if index == len(names) or names[index] != container.name:
+                names.insert(index, container.name)
 
     def detach(self, container):
         """
@@ -67,7 +141,11 @@ class Network(object):
         :param container: Container instance to attach
         """
 
-        self.containers.remove(container)
+        names = self.container_names
+        if names is not None:
+            index = bisect.bisect_left(names, container.name)
+            if index < len(names) and names[index] == container.name:
+                del names[index]
 
     def get_type(self):
         """
@@ -86,48 +164,94 @@ class Network(object):
 
         pass
 
+    def get_interfaces(self, container, netns):
+        """
+        Returns names of interfaces created when attaching a container to
+        this network.
+
+        :param container: Container instance
+        :param netns: Container network namespace
+        """
+
+        return []
+
+    def validate_attachments(self, attachments):
+        """
+        Validates network configuration of many attachments at once. Should
+        raise `NetworkConfigurationError` on errors.
+
+        :param attachments: List of `Attachment` instances
+        """
+
+        for attachment in attachments:
+            self.validate(attachment.config)
+
     def apply(self, container, netcfg=None, detach=False):
         """
         Applies network configuration to a running container.
 
         :param container: Container instance
+        :return: True if configuration has been applied successfully
         """
 
         raise NotImplementedError
 
-    @contextlib.contextmanager
-    def network_namespace(self, container):
+    def apply_batch(self, items):
         """
-        Context manager for network namespaces.
+        Applies network configuration to many running containers at once.
+
+        :param items: List of (container, network configuration) tuples
+        :return: List with one entry for each item, which is the time when
+          configuration of the item has been applied (readiness is measured
+          from it) or None if applying failed
         """
 
-        # Create network namespace
-        netns = container.get_netns()
-        netns_dir = '/var/run/netns'
+        applied = []
+        for container, netcfg in items:
+            success = self.apply(container, netcfg)
+            applied.append(time.time() if success else None)
 
-        try:
-            os.makedirs(netns_dir)
-        except OSError:
-            pass
+        return applied
 
-        try:
-            os.unlink(os.path.join(netns_dir, netns))
-        except OSError:
-            pass
+    def check_ready(self, container, netcfg, netns):
+        """
+        Checks whether the applied configuration is usable inside a running
+        container, for example whether addresses have completed duplicate
+        address detection. Must not block.
 
-        try:
-            os.symlink(os.path.join('/proc', netns, 'ns/net'), os.path.join(netns_dir, netns))
-        except OSError:
-            pass
+        :param container: Container instance
+        :param netcfg: Network configuration
+        :param netns: Container network namespace
+        :return: True if configuration is usable, False if it will never
+          become usable or None if it is not yet usable
+        """
 
-        try:
+        return True
+
+    def verify(self, container, netcfg, netns, host_state, netns_state):
+        """
+        Compares applied network configuration with the current kernel
+        state and returns a list of detected differences. Networks that do
+        not support verification never report drift.
+
+        :param container: Container instance
+        :param netcfg: Network configuration
+        :param netns: Container network namespace
+        :param host_state: `KernelState` of the host namespace
+        :param netns_state: `KernelState` of the container namespace
+        :return: List of problem descriptions
+        """
+
+        return []
+
+    @contextlib.contextmanager
+    def network_namespace(self, container):
+        """
+        Context manager for network namespaces.
+        """
+
+        with namespace_link(container.get_netns()) as netns:
             yield netns
-        finally:
-            # Cleanup network namespace
-            try:
-                os.unlink(os.path.join(netns_dir, netns))
-            except OSError:
-                pass
 
     def execute(self, command, errors=True):
         """
@@ -143,3 +267,24 @@ class Network(object):
                 return
 
             raise
+
+    def execute_batch(self, commands):
+        """
+        Executes `ip` commands by a single invocation of `ip -batch`.
+        Remaining commands are executed even when some of them fail.
+
+        :param commands: List of `ip` commands without the leading `ip`
+        :return: True if all commands succeeded
+        """
+
+        process = subprocess.Popen(['ip', '-force', '-batch', '-'], stdin=subprocess.PIPE)
+        process.communicate(''.join(['%s\n' % command for command in commands]))
+        return process.returncode == 0
+
+    def execute_output(self, command):
+        """
+        Executes a shell command and returns its output. Raises an exception
+        on non-zero return code.
+        """
+
+        return subprocess.check_output(command, shell=True)
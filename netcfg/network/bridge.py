@@ -3,17 +3,28 @@ import ipaddr
 import logging
 import os
 import subprocess
+import time
 
 from . import base
+from . import state
+from .. import utils
 
 logger = logging.getLogger('netcfg.network.bridge')
 
+# Supported modes of IPv6 duplicate address detection
+DAD_MODES = ('on', 'optimistic', 'off')
+
 
 class BridgeNetwork(base.Network):
     """
     Bridged network implementation.
     """
 
+    __slots__ = ()
+
+    supports_batch_apply = True
+    supports_reconcile = True
+
     def __init__(self, name, **kwargs):
         """
         Class constructor.
@@ -56,35 +67,158 @@ class BridgeNetwork(base.Network):
                 except ValueError:
                     raise base.NetworkConfigurationError('Invalid IPv4/IPv6 address: %s' % address)
 
+        # Configure address readiness
+        if netcfg.get('dad', 'on') not in DAD_MODES:
+            raise base.NetworkConfigurationError('Invalid DAD mode, must be one of: %s' % ', '.join(DAD_MODES))
+
+        if not isinstance(netcfg.get('announce', False), bool):
+            raise base.NetworkConfigurationError('Invalid announce configuration.')
+
+    def validate_attachments(self, attachments):
+        """
+        Validates network configuration of many attachments at once. Packed
+        addresses have already been parsed, so only their prefix lengths are
+        checked, and every other address is parsed only once.
+
+        :param attachments: List of `Attachment` instances
+        """
+
+        valid = set()
+        for attachment in attachments:
+            if attachment.options is None:
+                continue
+
+            # Validate options without the packed addresses
+            self.validate(dict(attachment.options))
+
+            for address in attachment.addresses or ():
+                if isinstance(address, tuple):
+                    packed, prefixlen = address
+                    if not 0 <= prefixlen <= len(packed) * 8:
+                        raise base.NetworkConfigurationError(
+                            'Invalid IPv4/IPv6 address: %s' % utils.unpack_address(address))
+                elif address not in valid:
+                    self.validate({'address': [address]})
+                    valid.add(address)
+
+    def get_veth_names(self, container, netns):
+        """
+        Returns the names of the host and guest veth interfaces used for
+        attaching a container to this network.
+
+        :param container: Container instance
+        :param netns: Container network namespace
+        :return: A tuple (host interface name, guest interface name)
+        """
+
+        veth_id = hashlib.md5(container.name + self.name + netns).hexdigest()
+        return 've%s1' % veth_id[:7], 've%s2' % veth_id[:7]
+
+    def get_interfaces(self, container, netns):
+        """
+        Returns names of interfaces created when attaching a container to
+        this network.
+
+        :param container: Container instance
+        :param netns: Container network namespace
+        """
+
+        return list(self.get_veth_names(container, netns))
+
+    def create_bridge(self):
+        """
+        Creates the bridge if one does not yet exist.
+
+        :return: True if the bridge exists
+        """
+
+        if os.path.isdir(os.path.join('/sys/class/net', self.name)):
+            return True
+
+        try:
+            self.execute('ip link add dev %s type bridge' % self.name)
+            self.execute('ip link set %s up' % self.name)
+        except subprocess.CalledProcessError:
+            logger.error("Failed to create bridge '%s'!", self.name)
+            self.execute('ip link delete %s' % self.name, errors=False)
+            return False
+
+        return True
+
+    def get_sysctls(self, ifname, netcfg):
+        """
+        Returns sysctl settings of the guest interface, in the form
+        `key=value`, which must be set before addresses are configured.
+
+        :param ifname: Guest interface name
+        :param netcfg: Network configuration
+        """
+
+        sysctls = []
+
+        # When requested, announce addresses to neighbours (gratuitous ARP and
+        # unsolicited NA) when the interface comes up or its addresses change
+        if netcfg.get('announce', False):
+            sysctls.append('net.ipv4.conf.%s.arp_notify=1' % ifname)
+            sysctls.append('net.ipv6.conf.%s.ndisc_notify=1' % ifname)
+
+        dad = netcfg.get('dad', 'on')
+        if dad == 'optimistic':
+            sysctls.append('net.ipv6.conf.%s.optimistic_dad=1' % ifname)
+        elif dad == 'off':
+            sysctls.append('net.ipv6.conf.%s.accept_dad=0' % ifname)
+
+        return sysctls
+
+    def get_address_flags(self, ip, netcfg):
+        """
+        Returns flags of `ip addr add` for an address of the guest interface.
+
+        :param ip: Address string
+        :param netcfg: Network configuration
+        """
+
+        dad = netcfg.get('dad', 'on')
+        if ':' in ip and dad == 'off':
+            return ' nodad'
+        elif ':' in ip and dad == 'optimistic':
+            return ' optimistic'
+
+        return ''
+
     def apply(self, container, netcfg=None, detach=False):
         """
         Applies network configuration to a running container.
 
         :param container: Container instance
+        :return: True if configuration has been applied successfully
         """
 
         if netcfg is None:
             netcfg = {}
 
         if detach:
-            logger.info("Detaching network configuration '%s' from container '%s'." % (self.name, container.name))
+            logger.info("Detaching network configuration '%s' from container '%s'.", self.name, container.name)
+
+            # When the container is still running, remove its veth pair; otherwise
+            # the pair has already been destroyed together with the namespace
+            netns = container.get_netns()
+            if netns is not None:
+                veth_host, _ = self.get_veth_names(container, netns)
+                if os.path.isdir(os.path.join('/sys/class/net', veth_host)):
+                    try:
+                        self.execute('ip link delete dev %s' % veth_host)
+                    except subprocess.CalledProcessError:
+                        logger.error("Failed to remove host interface '%s'!", veth_host)
+                        return False
         else:
-            logger.info("Applying network configuration '%s' to container '%s'." % (self.name, container.name))
+            logger.info("Applying network configuration '%s' to container '%s'.", self.name, container.name)
 
-            # Create a bridge if one does not yet exist
-            if not os.path.isdir(os.path.join('/sys/class/net', self.name)):
-                try:
-                    self.execute('ip link add dev %s type bridge' % self.name)
-                    self.execute('ip link set %s up' % self.name)
-                except subprocess.CalledProcessError:
-                    logger.error("Failed to create bridge '%s'!" % self.name)
-                    self.execute('ip link delete %s' % self.name, errors=False)
-                    return
+            if not self.create_bridge():
+                return False
 
             with self.network_namespace(container) as netns:
-                veth_id = hashlib.md5(container.name + self.name + netns).hexdigest()
-                veth_host = 've%s1' % veth_id[:7]
-                veth_guest = 've%s2' % veth_id[:7]
+                veth_host, veth_guest = self.get_veth_names(container, netns)
 
                 # Create veth interface pair
                 try:
@@ -94,19 +228,19 @@ class BridgeNetwork(base.Network):
                         )
                     )
                 except subprocess.CalledProcessError:
-                    logger.error("Failed to create veth pair for network '%s', container '%s'!" % (
-                        self.name, container.name))
-                    return
+                    logger.error("Failed to create veth pair for network '%s', container '%s'!",
+                                 self.name, container.name)
+                    return False
 
                 # Join host interface to the bridge and bring it up
                 try:
                     self.execute('ip link set %s master %s' % (veth_host, self.name))
                     self.execute('ip link set %s up' % veth_host)
                 except subprocess.CalledProcessError:
-                    logger.error("Failed to join host interface '%s' into bridge '%s'!" % (
-                        veth_host, self.name))
+                    logger.error("Failed to join host interface '%s' into bridge '%s'!",
+                                 veth_host, self.name)
                     self.execute('ip link delete dev %s' % veth_host, errors=False)
-                    return
+                    return False
 
                 # Move guest interface into the container namespace and rename it
                 ifname = netcfg.get('ifname', self.name)
@@ -116,22 +250,207 @@ class BridgeNetwork(base.Network):
                         netns, veth_guest, ifname
                     ))
                 except subprocess.CalledProcessError:
-                    logger.error("Failed to move guest interface '%s' into netns '%s'!" % (
-                        veth_guest, netns))
+                    logger.error("Failed to move guest interface '%s' into netns '%s'!",
+                                 veth_guest, netns)
                     self.execute('ip link delete dev %s' % veth_host, errors=False)
-                    return
+                    return False
+
+                for sysctl in self.get_sysctls(ifname, netcfg):
+                    self.execute('ip netns exec %s sysctl -q -w %s' % (netns, sysctl), errors=False)
 
                 # When requested, setup IP configuration
                 for ip in netcfg.get('address', None) or []:
                     try:
-                        self.execute('ip netns exec %s ip addr add %s dev %s' % (netns, ip, ifname))
+                        self.execute('ip netns exec %s ip addr add %s dev %s%s' % (
+                            netns, ip, ifname, self.get_address_flags(ip, netcfg)))
                     except subprocess.CalledProcessError:
-                        logger.warning("Unable to configure IP for guest interface '%s'." % ifname)
+                        logger.warning("Unable to configure IP for guest interface '%s'.", ifname)
 
                 # Bringe the guest device up
                 try:
                     self.execute('ip netns exec %s ip link set %s up' % (netns, ifname))
                 except subprocess.CalledProcessError:
-                    logger.error("Failed to bring guest interface '%s' up!" % ifname)
+                    logger.error("Failed to bring guest interface '%s' up!", ifname)
                     self.execute('ip link delete dev %s' % veth_host, errors=False)
-                    return
+                    return False
+
+        return True
+
+    def apply_batch(self, items):
+        """
+        Applies network configuration to many running containers at once.
+        Host interfaces of all containers are created by a single `ip -batch`
+        invocation and each guest interface is configured by a single command
+        in its namespace, which also returns the resulting state. Containers
+        whose resulting state does not match the configuration are applied
+        again one by one.
+
+        :param items: List of (container, network configuration) tuples
+        :return: List with one entry for each item, which is the time when
+          configuration of the item has been applied (readiness is measured
+          from it) or None if applying failed
+        """
+
+        results = [None] * len(items)
+        if not items or not self.create_bridge():
+            return results
+
+        logger.info("Applying network configuration '%s' to %d containers.", self.name, len(items))
+
+        # Create veth pairs, join host interfaces to the bridge and move guest
+        # interfaces into container namespaces
+        prepared = []
+        commands = []
+        for index, (container, netcfg) in enumerate(items):
+            netns = container.get_netns()
+            if netns is None:
+                continue
+
+            netcfg = netcfg or {}
+            veth_host, veth_guest = self.get_veth_names(container, netns)
+            commands.append('link add name %s mtu 1500 type veth peer name %s mtu 1500' % (veth_host, veth_guest))
+            commands.append('link set %s master %s' % (veth_host, self.name))
+            commands.append('link set %s up' % veth_host)
+            commands.append('link set %s netns %s' % (veth_guest, netns))
+            prepared.append((index, container, netcfg, netns, veth_host, veth_guest))
+
+        if not prepared:
+            return results
+
+        self.execute_batch(commands)
+
+        # Configure guest interfaces and dump the resulting state, addresses of
+        # each container are configured when its script finishes
+        guest_states = {}
+        finished = {}
+        for index, container, netcfg, netns, veth_host, veth_guest in prepared:
+            ifname = netcfg.get('ifname', self.name)
+            script = ['ip link set %s name %s' % (veth_guest, ifname)]
+            script.extend(['sysctl -q -w %s' % sysctl for sysctl in self.get_sysctls(ifname, netcfg)])
+            for ip in netcfg.get('address', None) or []:
+                script.append('ip addr add %s dev %s%s' % (ip, ifname, self.get_address_flags(ip, netcfg)))
+            script.append('ip link set %s up' % ifname)
+            script.append('ip -o link show')
+            script.append('ip -o addr show')
+
+            with base.namespace_link(netns):
+                try:
+                    output = self.execute_output("ip netns exec %s sh -c '%s' 2>/dev/null" % (netns, '; '.join(script)))
+                except subprocess.CalledProcessError:
+                    output = ''
+
+            finished[index] = time.time()
+            guest_states[index] = state.KernelState(output)
+
+        host_state = state.dump_host()
+        for index, container, netcfg, netns, veth_host, veth_guest in prepared:
+            problems = self.verify(container, netcfg, netns, host_state, guest_states[index])
+            if not problems:
+                results[index] = finished[index]
+                continue
+
+            logger.warning("Batch configuration of network '%s' failed for container '%s' (%s), applying again.",
+                           self.name, container.name, '; '.join(problems))
+            if veth_host in host_state.links:
+                self.execute('ip link delete dev %s' % veth_host, errors=False)
+            if self.apply(container, netcfg):
+                results[index] = time.time()
+
+        return results
+
+    def verify(self, container, netcfg, netns, host_state, netns_state):
+        """
+        Compares applied network configuration with the current kernel
+        state and returns a list of detected differences.
+
+        :param container: Container instance
+        :param netcfg: Network configuration
+        :param netns: Container network namespace
+        :param host_state: `KernelState` of the host namespace
+        :param netns_state: `KernelState` of the container namespace
+        :return: List of problem descriptions
+        """
+
+        if netcfg is None:
+            netcfg = {}
+
+        problems = []
+        bridge = host_state.links.get(self.name)
+        if bridge is None:
+            problems.append("bridge '%s' is missing" % self.name)
+        elif not bridge.is_up():
+            problems.append("bridge '%s' is down" % self.name)
+
+        veth_host, _ = self.get_veth_names(container, netns)
+        link = host_state.links.get(veth_host)
+        if link is None:
+            problems.append("host interface '%s' is missing" % veth_host)
+        elif link.master != self.name:
+            problems.append("host interface '%s' is not part of the bridge" % veth_host)
+        elif not link.is_up():
+            problems.append("host interface '%s' is down" % veth_host)
+
+        ifname = netcfg.get('ifname', self.name)
+        link = netns_state.links.get(ifname)
+        if link is None:
+            problems.append("guest interface '%s' is missing" % ifname)
+        else:
+            if not link.is_up():
+                problems.append("guest interface '%s' is down" % ifname)
+
+            for address in netcfg.get('address', None) or []:
+                if not netns_state.has_address(ifname, address):
+                    problems.append("address %s is missing on guest interface '%s'" % (address, ifname))
+
+        return problems
+
+    def check_ready(self, container, netcfg, netns):
+        """
+        Checks whether the guest interface is up and none of the configured
+        addresses are tentative, by using a single command in the container
+        namespace.
+
+        :param container: Container instance
+        :param netcfg: Network configuration
+        :param netns: Container network namespace
+        :return: True if configuration is usable, False if it will never
+          become usable or None if it is not yet usable
+        """
+
+        ifname = netcfg.get('ifname', self.name)
+        configured = set([str(ipaddr.IPNetwork(address).ip) for address in netcfg.get('address', None) or []])
+        with base.namespace_link(netns):
+            try:
+                output = self.execute_output("ip netns exec %s sh -c 'ip -o link show dev %s; ip -o addr show dev %s'" % (
+                    netns, ifname, ifname))
+            except subprocess.CalledProcessError:
+                logger.error("Failed to check state of guest interface '%s'!", ifname)
+                return False
+
+        # Address lines are in the form '<index>: <ifname> inet6 <address>/<prefixlen> ... <flags>'
+        link_up = False
+        tentative = False
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) < 4:
+                continue
+
+            if fields[2].startswith('<'):
+                link_up = 'LOWER_UP' in fields[2]
+                continue
+
+            if str(ipaddr.IPNetwork(fields[3]).ip) not in configured:
+                continue
+
+            if 'dadfailed' in fields:
+                logger.error("Duplicate address %s detected on guest interface '%s'!", fields[3], ifname)
+                return False
+
+            # Optimistic addresses are usable while still tentative
+            if 'tentative' in fields and 'optimistic' not in fields:
+                tentative = True
+
+        if link_up and not tentative:
+            return True
+
+        return None
@@ -0,0 +1,113 @@
+import ipaddr
+import subprocess
+
+from . import base
+
+
+class Link(object):
+    """
+    State of a single network interface.
+    """
+
+    __slots__ = ('name', 'flags', 'master')
+
+    def __init__(self, name, flags, master=None):
+        """
+        Class constructor.
+
+        :param name: Interface name
+        :param flags: Set of interface flags
+        :param master: Name of the master interface (bridge)
+        """
+
+        self.name = name
+        self.flags = flags
+        self.master = master
+
+    def is_up(self):
+        """
+        Returns True if the interface has been administratively brought up.
+        """
+
+        return 'UP' in self.flags
+
+
+class KernelState(object):
+    """
+    Links and addresses of a network namespace, parsed from the one-line
+    output of `ip link show` and `ip addr show`.
+    """
+
+    def __init__(self, output=''):
+        """
+        Class constructor.
+
+        :param output: Output of `ip -o link show` and/or `ip -o addr show`
+        """
+
+        self.links = {}
+        self.addresses = {}
+
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) < 3:
+                continue
+
+            if fields[2] in ('inet', 'inet6'):
+                # Lines are in the form '<index>: <ifname> inet <address>/<prefixlen> ...'
+                if len(fields) < 4:
+                    continue
+
+                try:
+                    address = str(ipaddr.IPNetwork(fields[3]))
+                except ValueError:
+                    continue
+
+                self.addresses.setdefault(fields[1], set()).add(address)
+            elif fields[2].startswith('<'):
+                # Lines are in the form '<index>: <ifname>[@<peer>]: <FLAGS> ... master <bridge> ...'
+                name = fields[1].rstrip(':').split('@')[0]
+                flags = set(fields[2].strip('<>').split(','))
+                master = None
+                if 'master' in fields[3:-1]:
+                    master = fields[fields.index('master', 3) + 1]
+
+                self.links[name] = Link(name, flags, master)
+
+    def has_address(self, ifname, address):
+        """
+        Returns True if an address is configured on an interface.
+
+        :param ifname: Interface name
+        :param address: Address string
+        """
+
+        try:
+            address = str(ipaddr.IPNetwork(address))
+        except ValueError:
+            return False
+
+        return address in self.addresses.get(ifname, ())
+
+
+def dump_host():
+    """
+    Returns the `KernelState` of the host network namespace.
+    """
+
+    return KernelState(subprocess.check_output('ip -o link show', shell=True))
+
+
+def dump_netns(netns):
+    """
+    Returns the `KernelState` of a container network namespace, obtained
+    with a single command.
+
+    :param netns: Container network namespace (PID)
+    """
+
+    with base.namespace_link(netns):
+        return KernelState(subprocess.check_output(
+            "ip netns exec %s sh -c 'ip -o link show; ip -o addr show'" % netns,
+            shell=True,
+        ))
@@ -0,0 +1,198 @@
+import collections
+import logging
+import time
+import traceback
+
+logger = logging.getLogger('netcfg.readiness')
+
+# Interval in seconds between checks of pending configuration
+CHECK_INTERVAL = 0.05
+
+# Maximum number of pending configurations checked in one main loop iteration
+CHECK_BUDGET = 20
+
+# Maximum number of seconds readiness of applied configuration is tracked for
+MAX_WAIT_READY = 60
+
+# Number of completed outcomes kept for clients that missed the event
+RESULT_HISTORY = 1000
+
+
+class ReadinessTracker(object):
+    """
+    Tracks applied network configuration until it becomes usable, for
+    example until addresses have completed duplicate address detection.
+    Instead of waiting, configuration is checked periodically from the
+    daemon main loop and the outcome is published as a `network_ready`
+    event.
+    """
+
+    def __init__(self, interval=CHECK_INTERVAL, budget=CHECK_BUDGET):
+        """
+        Class constructor.
+
+        :param interval: Number of seconds between checks
+        :param budget: Maximum number of configurations checked at once
+        """
+
+        self.interval = interval
+        self.budget = budget
+        self.pending = collections.OrderedDict()
+        self.results = collections.OrderedDict()
+        self.last_check = 0
+        self.ready = 0
+        self.failed = 0
+        self.timeouts = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, container, network, netcfg, started, timeout):
+        """
+        Starts tracking applied configuration.
+
+        :param container: Container instance
+        :param network: Network instance
+        :param netcfg: Network configuration
+        :param started: Time from which readiness is measured
+        :param timeout: Number of seconds after the start time when tracking
+          gives up
+        """
+
+        netns = container.get_netns()
+        if netns is None:
+            return
+
+        key = (container.name, network.name)
+        self.results.pop(key, None)
+        self.pending[key] = (
+            container,
+            network,
+            netcfg,
+            netns,
+            started,
+            timeout,
+        )
+
+    def discard(self, container, network):
+        """
+        Stops tracking configuration, for example because it has been removed.
+
+        :param container: Container instance
+        :param network: Network instance
+        """
+
+        self.pending.pop((container.name, network.name), None)
+
+    def get_status(self, container, network):
+        """
+        Returns the readiness status of applied configuration: a dictionary
+        with `pending` set to True while it is being tracked, otherwise with
+        `ready` set to the number of seconds until it became usable or None
+        if it did not become usable in time. Returns None when configuration
+        is not tracked and no recent outcome is known.
+
+        :param container: Container name
+        :param network: Network name
+        """
+
+        key = (container, network)
+        if key in self.pending:
+            return {'pending': True}
+        elif key in self.results:
+            return {'pending': False, 'ready': self.results[key]}
+
+        return None
+
+    def get_timeout(self):
+        """
+        Returns the number of seconds until the next check is due, or None
+        when nothing is pending.
+        """
+
+        if not self.pending:
+            return None
+
+        return max(0, self.last_check + self.interval - time.time())
+
+    def check(self, key):
+        """
+        Checks a single pending configuration.
+
+        :param key: Tuple (container name, network name)
+        :return: Number of seconds until the configuration became usable,
+          False if it failed or did not become usable in time, or None when
+          it is still pending
+        """
+
+        container, network, netcfg, netns, started, timeout = self.pending[key]
+        try:
+            ready = network.check_ready(container, netcfg, netns)
+        except:
+            logger.error("Exception raised while checking readiness of network '%s' in container '%s':",
+                         network.name, container.name)
+            logger.error(traceback.format_exc())
+            ready = False
+
+        now = time.time()
+        if ready:
+            self.ready += 1
+            logger.info("Network '%s' ready in container '%s' after %.3f seconds.",
+                        network.name, container.name, now - started)
+            return now - started
+        elif ready is False:
+            self.failed += 1
+            return False
+        elif now >= started + timeout:
+            self.timeouts += 1
+            logger.warning("Network '%s' not ready in container '%s' after %s seconds.",
+                           network.name, container.name, timeout)
+            return False
+
+        return None
+
+    def tick(self, daemon):
+        """
+        Performs periodic work: checks pending configuration, at most
+        `budget` entries at once, and publishes the outcome of completed
+        ones.
+
+        :param daemon: Daemon instance
+        """
+
+        if not self.pending or self.get_timeout() > 0:
+            return
+
+        self.last_check = time.time()
+        for _ in xrange(min(self.budget, len(self.pending))):
+            key, entry = self.pending.popitem(last=False)
+            self.pending[key] = entry
+
+            result = self.check(key)
+            if result is None:
+                continue
+
+            del self.pending[key]
+            ready = result if result is not False else None
+            self.results[key] = ready
+            if len(self.results) > RESULT_HISTORY:
+                self.results.popitem(last=False)
+
+            daemon.publish(
+                'network_ready',
+                container=key[0],
+                network=key[1],
+                ready=ready,
+            )
+
+    def get_stats(self):
+        """
+        Returns readiness statistics.
+        """
+
+        return {
+            'pending': len(self.pending),
+            'ready': self.ready,
+            'failed': self.failed,
+            'timeouts': self.timeouts,
+        }
@@ -0,0 +1,465 @@
+import json
+import logging
+import re
+import time
+import zmq
+
+logger = logging.getLogger('netcfg.replication')
+
+# Methods that modify configuration and are replicated to followers
+REPLICATED_METHODS = ('flush', 'create_network', 'attach', 'detach', 'set_config')
+
+# Interval in seconds between leader heartbeats
+HEARTBEAT_INTERVAL = 1.0
+
+# Seconds after which a snapshot request is repeated
+SNAPSHOT_TIMEOUT = 5.0
+
+# Maximum number of deltas buffered while waiting for a snapshot
+MAX_BUFFERED_DELTAS = 10000
+
+
+def get_endpoints(address):
+    """
+    Returns the delta publishing and synchronization endpoints for a
+    replication address. Deltas are published on the given port and the
+    synchronization socket uses the next port.
+
+    :param address: Replication address in the form 'tcp://host:port'
+    :return: A tuple (publish endpoint, sync endpoint)
+    """
+
+    match = re.match(r'^(tcp://.+):(\d+)$', address)
+    if not match:
+        raise ValueError("Invalid replication address '%s'." % address)
+
+    return address, '%s:%d' % (match.group(1), int(match.group(2)) + 1)
+
+
+def parse_message(payload, fields):
+    """
+    Parses a replication message received from the network. Raises
+    `ValueError` when the message is malformed.
+
+    :param payload: JSON serialized message
+    :param fields: Fields that must be present in the message
+    :return: Message dictionary
+    """
+
+    msg = json.loads(payload)
+    if not isinstance(msg, dict):
+        raise ValueError('message is not an object')
+
+    for field in fields:
+        if field not in msg:
+            raise ValueError("field '%s' is missing" % field)
+
+    if not isinstance(msg['version'], (int, long)) or isinstance(msg['version'], bool):
+        raise ValueError('version is not an integer')
+
+    return msg
+
+
+class ReplicationLeader(object):
+    """
+    Publishes versioned configuration deltas to follower daemons and serves
+    configuration snapshots.
+    """
+
+    def __init__(self, context, address, epoch):
+        """
+        Class constructor.
+
+        :param context: ZMQ context
+        :param address: Replication address to bind to
+        :param epoch: Daemon epoch, which changes whenever the leader restarts
+        """
+
+        endpoint_pub, endpoint_sync = get_endpoints(address)
+        self.socket_pub = context.socket(zmq.PUB)
+        self.socket_pub.bind(endpoint_pub)
+        self.socket_sync = context.socket(zmq.ROUTER)
+        self.socket_sync.bind(endpoint_sync)
+        self.epoch = epoch
+        self.version = 0
+        self.followers = {}
+        self.last_heartbeat = 0
+
+    @property
+    def sockets(self):
+        return [self.socket_sync]
+
+    def publish(self, request):
+        """
+        Publishes a configuration delta.
+
+        :param request: Configuration modifying RPC request
+        """
+
+        self.version += 1
+        self.socket_pub.send_multipart(['delta', json.dumps({
+            'epoch': self.epoch,
+            'version': self.version,
+            'request': request,
+        })])
+
+    def get_timeout(self):
+        """
+        Returns the number of seconds until the next heartbeat is due.
+        """
+
+        return max(0, self.last_heartbeat + HEARTBEAT_INTERVAL - time.time())
+
+    def tick(self, daemon):
+        """
+        Performs periodic work: publishes heartbeats announcing the current
+        version, so idle followers can detect missed deltas.
+
+        :param daemon: Daemon instance
+        """
+
+        if self.get_timeout() > 0:
+            return
+
+        self.last_heartbeat = time.time()
+        self.socket_pub.send_multipart(['heartbeat', json.dumps({
+            'epoch': self.epoch,
+            'version': self.version,
+        })])
+
+    def process(self, socket, daemon):
+        """
+        Processes a message from a follower.
+
+        :param socket: Socket with a pending message
+        :param daemon: Daemon instance
+        """
+
+        identity, payload = socket.recv_multipart()
+        try:
+            msg = json.loads(payload)
+            method = msg['method']
+            follower = msg['follower']
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Malformed replication message received.")
+            return
+
+        if method == 'snapshot':
+            logger.info("Sending configuration snapshot to follower '%s'.", follower)
+            socket.send_multipart([identity, json.dumps({
+                'epoch': self.epoch,
+                'version': self.version,
+                'config': daemon.config.serialize(),
+            })])
+        elif method == 'ack':
+            self.followers[follower] = {
+                'epoch': msg.get('epoch'),
+                'version': msg.get('version', 0),
+                'error': msg.get('error'),
+                'apply_failures': msg.get('apply_failures', 0),
+                'timestamp': time.time(),
+            }
+
+    def get_stats(self):
+        """
+        Returns replication statistics.
+        """
+
+        now = time.time()
+        followers = {}
+        for follower, state in self.followers.items():
+            current = state['epoch'] == self.epoch
+            followers[follower] = {
+                'version': state['version'],
+                'lag': self.version - state['version'] if current else None,
+                'last_seen': now - state['timestamp'],
+                'error': state['error'],
+                'apply_failures': state['apply_failures'],
+            }
+
+        return {
+            'role': 'leader',
+            'version': self.version,
+            'followers': followers,
+        }
+
+
+class ReplicationFollower(object):
+    """
+    Receives configuration deltas from a leader daemon and applies them to
+    the local configuration.
+    """
+
+    def __init__(self, context, address, follower_id):
+        """
+        Class constructor.
+
+        :param context: ZMQ context
+        :param address: Replication address of the leader
+        :param follower_id: Identifier of this follower
+        """
+
+        endpoint_pub, endpoint_sync = get_endpoints(address)
+        self.socket_sub = context.socket(zmq.SUB)
+        self.socket_sub.connect(endpoint_pub)
+        self.socket_sub.setsockopt(zmq.SUBSCRIBE, '')
+        self.socket_sync = context.socket(zmq.DEALER)
+        self.socket_sync.setsockopt(zmq.LINGER, 0)
+        self.socket_sync.connect(endpoint_sync)
+        self.follower_id = follower_id
+        self.epoch = None
+        self.version = 0
+        self.leader_version = 0
+        self.snapshot_requested = None
+        self.syncing_since = None
+        self.buffered = []
+        self.dropped_deltas = 0
+        self.errors = 0
+        self.last_error = None
+        self.apply_failures = 0
+
+    @property
+    def sockets(self):
+        return [self.socket_sub, self.socket_sync]
+
+    def send(self, method, **kwargs):
+        """
+        Sends a message to the leader without waiting for a reply.
+        """
+
+        kwargs['method'] = method
+        kwargs['follower'] = self.follower_id
+        try:
+            self.socket_sync.send(json.dumps(kwargs), zmq.NOBLOCK)
+        except zmq.Again:
+            logger.warning("Unable to send '%s' to replication leader.", method)
+
+    def request_snapshot(self):
+        """
+        Requests a complete configuration snapshot from the leader.
+        """
+
+        logger.info("Requesting configuration snapshot from replication leader.")
+        self.snapshot_requested = time.time()
+        if self.syncing_since is None:
+            self.syncing_since = self.snapshot_requested
+        self.send('snapshot')
+
+    def ack(self):
+        """
+        Reports the applied version and any errors to the leader.
+        """
+
+        self.send(
+            'ack',
+            epoch=self.epoch,
+            version=self.version,
+            error=self.last_error,
+            apply_failures=self.apply_failures,
+        )
+
+    def set_error(self, error):
+        """
+        Records a replication error, which is reported to the leader.
+
+        :param error: Error message
+        """
+
+        self.errors += 1
+        self.last_error = error
+
+    def reject(self, error):
+        """
+        Records a malformed message received from the leader.
+
+        :param error: Exception describing the problem
+        """
+
+        logger.warning("Malformed replication message received: %s.", error)
+        self.set_error('Malformed replication message received: %s.' % error)
+
+    def get_timeout(self):
+        """
+        Returns the number of seconds until a pending snapshot request should
+        be repeated, or None when no request is pending.
+        """
+
+        if self.snapshot_requested is None:
+            return None
+
+        return max(0, self.snapshot_requested + SNAPSHOT_TIMEOUT - time.time())
+
+    def tick(self, daemon):
+        """
+        Performs periodic work: repeats snapshot requests without reply.
+
+        :param daemon: Daemon instance
+        """
+
+        if self.snapshot_requested is not None and self.get_timeout() == 0:
+            self.request_snapshot()
+
+    def apply_delta(self, delta, daemon):
+        """
+        Applies a delta with the next version to the local configuration.
+        When the delta is rejected, the local configuration has diverged from
+        the leader and the version is not advanced.
+
+        :param delta: Delta message
+        :param daemon: Daemon instance
+        :return: True if the delta has been applied
+        """
+
+        # Failures to apply to local containers do not reject replicated configuration
+        request = delta['request']
+        response = json.loads(daemon.process_rpc(json.dumps(request), replicated=True))
+        if 'error' in response:
+            logger.warning("Replicated '%s' failed: %s", request.get('method'), response['error'])
+            self.set_error("Delta %d ('%s') failed: %s" % (delta['version'], request.get('method'), response['error']))
+            return False
+
+        if response.get('applied') is False:
+            self.apply_failures += 1
+        elif 'changes' in response:
+            self.apply_failures += len(response['changes'].get('failed', []))
+
+        self.version = delta['version']
+        return True
+
+    def process(self, socket, daemon):
+        """
+        Processes a message from the leader.
+
+        :param socket: Socket with a pending message
+        :param daemon: Daemon instance
+        """
+
+        if socket is self.socket_sync:
+            payload = socket.recv()
+            try:
+                snapshot = parse_message(payload, ('epoch', 'version', 'config'))
+            except ValueError, e:
+                # The snapshot is requested again after the timeout
+                self.reject(e)
+                return
+
+            self.process_snapshot(snapshot, daemon)
+            return
+
+        frames = socket.recv_multipart()
+        try:
+            if len(frames) != 2 or frames[0] not in ('delta', 'heartbeat'):
+                raise ValueError('unknown message type')
+
+            kind, payload = frames
+            msg = parse_message(payload, ('epoch', 'version', 'request') if kind == 'delta' else ('epoch', 'version'))
+            if kind == 'delta' and not isinstance(msg['request'], dict):
+                raise ValueError('request is not an object')
+        except ValueError, e:
+            # Deltas may have been lost, so resynchronize with the leader
+            self.reject(e)
+            if self.snapshot_requested is None:
+                self.request_snapshot()
+            return
+
+        self.leader_version = msg['version']
+
+        if self.snapshot_requested is not None:
+            # Deltas are applied after the snapshot has been received
+            if kind == 'delta':
+                if len(self.buffered) < MAX_BUFFERED_DELTAS:
+                    self.buffered.append(msg)
+                else:
+                    # The next heartbeat reveals the gap and another snapshot is requested
+                    self.dropped_deltas += 1
+            return
+
+        if msg['epoch'] != self.epoch or msg['version'] < self.version:
+            # Leader has been restarted
+            self.request_snapshot()
+            return
+
+        if kind == 'heartbeat':
+            if msg['version'] > self.version:
+                self.request_snapshot()
+            else:
+                self.ack()
+        elif kind == 'delta':
+            if msg['version'] == self.version + 1:
+                if self.apply_delta(msg, daemon):
+                    self.ack()
+                else:
+                    self.request_snapshot()
+            elif msg['version'] > self.version + 1:
+                logger.warning("Missed replication deltas %d to %d.", self.version + 1, msg['version'] - 1)
+                self.buffered.append(msg)
+                self.request_snapshot()
+
+    def process_snapshot(self, snapshot, daemon):
+        """
+        Replaces the local configuration with a snapshot received from the
+        leader and applies any deltas received in the meantime.
+
+        :param snapshot: Snapshot message
+        :param daemon: Daemon instance
+        """
+
+        if self.snapshot_requested is None:
+            # Reply to a repeated request that has already been handled
+            return
+
+        # Configuration is accepted even when applying it to some local containers
+        # fails, otherwise the follower would never catch up
+        response = json.loads(daemon.process_rpc(json.dumps({
+            'method': 'set_config',
+            'config': snapshot['config'],
+        }), replicated=True))
+        if 'error' in response:
+            # The snapshot is requested again after the timeout
+            logger.error("Failed to apply configuration snapshot: %s", response['error'])
+            self.set_error('Snapshot version %d rejected: %s' % (snapshot['version'], response['error']))
+            self.ack()
+            return
+
+        failed = response['changes']['failed']
+        if failed:
+            logger.warning("Applied configuration snapshot version %d, but failed to apply %d attachments.",
+                           snapshot['version'], len(failed))
+        else:
+            logger.info("Applied configuration snapshot version %d.", snapshot['version'])
+
+        self.apply_failures += len(failed)
+        self.last_error = None
+        self.epoch = snapshot['epoch']
+        self.version = snapshot['version']
+        self.leader_version = max(self.leader_version, self.version)
+        self.snapshot_requested = None
+        self.syncing_since = None
+
+        buffered = self.buffered
+        self.buffered = []
+        for delta in buffered:
+            if delta['epoch'] == self.epoch and delta['version'] == self.version + 1:
+                if not self.apply_delta(delta, daemon):
+                    self.request_snapshot()
+                    break
+
+        self.ack()
+
+    def get_stats(self):
+        """
+        Returns replication statistics.
+        """
+
+        return {
+            'role': 'follower',
+            'version': self.version,
+            'leader_version': self.leader_version,
+            'lag': max(0, self.leader_version - self.version),
+            'syncing': self.snapshot_requested is not None,
+            'syncing_for': time.time() - self.syncing_since if self.syncing_since is not None else None,
+            'dropped_deltas': self.dropped_deltas,
+            'errors': self.errors,
+            'last_error': self.last_error,
+            'apply_failures': self.apply_failures,
+        }
@@ -0,0 +1,121 @@
+import socket
+import time
+
+
+def intern_string(value):
+    """
+    Returns a canonical instance of the given string so that equal names
+    and configuration keys share storage. The builtin `intern` is used, so
+    strings are released once they are no longer referenced. Unicode
+    strings, which is what the JSON decoder returns, are interned when
+    they only contain ASCII characters. Other values are returned
+    unchanged.
+
+    :param value: Value to intern
+    """
+
+    if isinstance(value, unicode):
+        try:
+            value = value.encode('ascii')
+        except UnicodeEncodeError:
+            return value
+
+    if not isinstance(value, str):
+        return value
+
+    return intern(value)
+
+
+def pack_address(address):
+    """
+    Converts an address string in the form `address/prefixlen` into a
+    compact `(packed address, prefix length)` tuple. Addresses that would
+    not be formatted back into an identical string are returned as
+    (interned) strings.
+
+    :param address: Address string
+    """
+
+    try:
+        ip, prefixlen = address.split('/')
+        family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+        packed = (socket.inet_pton(family, ip), int(prefixlen))
+    except (AttributeError, TypeError, ValueError, socket.error):
+        return intern_string(address)
+
+    if unpack_address(packed) != address:
+        return intern_string(address)
+
+    return packed
+
+
+def unpack_address(address):
+    """
+    Converts an address returned by `pack_address` back into its string
+    form.
+
+    :param address: Packed address
+    """
+
+    if not isinstance(address, tuple):
+        return address
+
+    packed, prefixlen = address
+    family = socket.AF_INET if len(packed) == 4 else socket.AF_INET6
+    return '%s/%d' % (socket.inet_ntop(family, packed), prefixlen)
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.time):
+        """
+        Class constructor.
+
+        :param rate: Number of tokens added per second
+        :param burst: Maximum number of tokens (defaults to rate)
+        :param clock: Function returning the current time in seconds
+        """
+
+        self.rate = float(rate)
+        self.burst = float(burst or max(rate, 1))
+        self.clock = clock
+        self.tokens = self.burst
+        self.timestamp = clock()
+
+    def refill(self):
+        """
+        Adds tokens accumulated since the last refill.
+        """
+
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.timestamp) * self.rate)
+        self.timestamp = now
+
+    def consume(self, count=1):
+        """
+        Attempts to take tokens from the bucket.
+
+        :param count: Number of tokens to take
+        :return: True if tokens were available
+        """
+
+        self.refill()
+        if self.tokens < count:
+            return False
+
+        self.tokens -= count
+        return True
+
+    def delay(self):
+        """
+        Returns the number of seconds until the next token becomes available.
+        """
+
+        self.refill()
+        if self.tokens >= 1:
+            return 0.0
+
+        return (1 - self.tokens) / self.rate
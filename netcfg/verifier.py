@@ -0,0 +1,198 @@
+import bisect
+import logging
+import subprocess
+import time
+import traceback
+
+from .network import state
+
+logger = logging.getLogger('netcfg.verifier')
+
+# Default interval in seconds between verification cycles
+VERIFY_INTERVAL = 60
+
+# Default maximum number of containers verified in one cycle
+VERIFY_BUDGET = 100
+
+# Default maximum number of seconds spent verifying in one cycle
+VERIFY_TIME_BUDGET = 0.1
+
+
+class DriftVerifier(object):
+    """
+    Periodically compares the kernel state of running containers with the
+    applied configuration and repairs attachments that have drifted, for
+    example because an interface or an address has been removed by hand.
+
+    Each cycle dumps the host links once and the links and addresses of
+    every verified container once. Containers are verified in name order,
+    continuing where the previous cycle stopped. A cycle ends after `budget`
+    containers or once `time_budget` seconds have been spent, whichever
+    comes first, so that slow dumps and repairs do not hold up the main
+    loop. At least one container is verified in every cycle.
+    """
+
+    def __init__(self, interval=VERIFY_INTERVAL, budget=VERIFY_BUDGET, time_budget=VERIFY_TIME_BUDGET,
+                 clock=time.time):
+        """
+        Class constructor.
+
+        :param interval: Number of seconds between verification cycles
+        :param budget: Maximum number of containers verified in one cycle
+        :param time_budget: Maximum number of seconds spent in one cycle
+        :param clock: Function returning the current time
+        """
+
+        self.interval = interval
+        self.budget = budget
+        self.time_budget = time_budget
+        self.clock = clock
+        self.last_cycle = clock()
+        self.cursor = None
+        self.cycles = 0
+        self.checked = 0
+        self.drifted = 0
+        self.repaired = 0
+        self.failed = 0
+        self.interrupted = 0
+        self.last_duration = None
+
+    def get_timeout(self):
+        """
+        Returns the number of seconds until the next cycle is due.
+        """
+
+        return max(0, self.last_cycle + self.interval - self.clock())
+
+    def tick(self, daemon):
+        """
+        Performs periodic work: runs a verification cycle when one is due.
+
+        :param daemon: Daemon instance
+        """
+
+        if self.get_timeout() > 0:
+            return
+
+        try:
+            self.verify(daemon)
+        except:
+            logger.error("Exception raised while verifying applied configuration:")
+            logger.error(traceback.format_exc())
+
+        self.last_cycle = self.clock()
+
+    def get_batch(self, names):
+        """
+        Returns the names of containers that may be verified in the next
+        cycle, starting after the cursor and wrapping around to the
+        beginning. The cursor is advanced by `verify` as containers are
+        verified.
+
+        :param names: Sorted list of names of containers with applied configuration
+        """
+
+        start = bisect.bisect_right(names, self.cursor) if self.cursor is not None else 0
+        batch = names[start:start + self.budget]
+        if len(batch) < self.budget:
+            # Wrap around to the beginning
+            batch += names[:min(start, self.budget - len(batch))]
+
+        return batch
+
+    def verify(self, daemon):
+        """
+        Runs a single verification cycle.
+
+        :param daemon: Daemon instance
+        """
+
+        started = self.clock()
+        config = daemon.config
+        ledger = daemon.ledger
+        batch = self.get_batch(sorted(ledger.records))
+        if not batch:
+            return
+
+        host_state = state.dump_host()
+        for index, name in enumerate(batch):
+            if index and self.clock() - started >= self.time_budget:
+                # Continue with this container in the next cycle
+                self.interrupted += 1
+                break
+
+            self.cursor = name
+            container = config.containers.get(name)
+            entry = ledger.records.get(name)
+            if container is None or entry is None:
+                continue
+
+            # Skip containers that have been restarted, events take care of them
+            applied = ledger.get_applied(name, entry['id'])
+            if not applied:
+                continue
+
+            # Only networks that are able to compare their state with the kernel are checked
+            attachments = [
+                att for att in container.attachments
+                if att.network.name in applied and att.network.supports_reconcile
+            ]
+            if not attachments:
+                continue
+
+            netns = str(entry['pid'])
+            try:
+                netns_state = state.dump_netns(netns)
+            except subprocess.CalledProcessError:
+                continue
+
+            self.checked += 1
+            for attachment in attachments:
+                network = attachment.network
+                netcfg = attachment.config
+                problems = network.verify(container, netcfg, netns, host_state, netns_state)
+                if not problems:
+                    continue
+
+                self.drifted += 1
+                logger.warning("Network '%s' of container '%s' has drifted: %s.",
+                               network.name, name, '; '.join(problems))
+
+                # Recreate the attachment from scratch
+                container.apply_network(network, netcfg, detach=True)
+                repaired = container.apply_network(network, netcfg)
+                if repaired:
+                    self.repaired += 1
+                    logger.info("Repaired network '%s' of container '%s'.", network.name, name)
+                else:
+                    self.failed += 1
+                    logger.error("Failed to repair network '%s' of container '%s'!", network.name, name)
+
+                daemon.publish(
+                    'drift',
+                    container=name,
+                    network=network.name,
+                    problems=problems,
+                    repaired=repaired,
+                )
+
+        self.cycles += 1
+        self.last_duration = self.clock() - started
+
+    def get_stats(self):
+        """
+        Returns verification statistics.
+        """
+
+        return {
+            'interval': self.interval,
+            'budget': self.budget,
+            'time_budget': self.time_budget,
+            'cycles': self.cycles,
+            'interrupted': self.interrupted,
+            'checked': self.checked,
+            'drifted': self.drifted,
+            'repaired': self.repaired,
+            'failed': self.failed,
+            'last_duration': self.last_duration,
+        }
@@ -19,6 +19,11 @@ if __name__ == '__main__':
         packages=find_packages(exclude=('*.tests', '*.tests.*', 'tests.*', 'tests')),
         package_data={},
         scripts=['scripts/netcfg'],
+        entry_points={
+            'netcfg.networks': [
+                'bridge = netcfg.network.bridge:BridgeNetwork',
+            ],
+        },
         classifiers=[
             'Development Status :: 4 - Beta',
             'Intended Audience :: System Administrators',
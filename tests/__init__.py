@@ -0,0 +1,3 @@
+import logging
+
+logging.getLogger('netcfg').addHandler(logging.NullHandler())
@@ -0,0 +1,111 @@
+import os
+
+from netcfg import network
+from netcfg.network import base
+
+
+class FakeDockerClient(object):
+    """
+    Docker client that reports containers as running in the network
+    namespace of the current process.
+    """
+
+    def __init__(self, stopped=()):
+        self.stopped = set(stopped)
+        self.inspected = []
+
+    def inspect_container(self, name):
+        self.inspected.append(name)
+        return {
+            'Id': 'id-%s' % name,
+            'State': {'Running': name not in self.stopped, 'Pid': os.getpid()},
+        }
+
+
+class FakeNetwork(base.Network):
+    """
+    Network type that keeps applied configuration in memory and can be made
+    to fail.
+    """
+
+    # Applied configuration as a dictionary mapping (container name, network name)
+    # tuples to network configuration
+    applied = {}
+
+    # Number of further attaches that succeed before one attach fails (None never fails)
+    fail_after = None
+
+    # Set of (container name, network name) tuples whose kernel state has drifted
+    drifted = set()
+
+    supports_reconcile = True
+
+    @classmethod
+    def reset(cls):
+        cls.applied = {}
+        cls.fail_after = None
+        cls.drifted = set()
+
+    def get_type(self):
+        return 'fake'
+
+    def validate(self, netcfg):
+        pass
+
+    def get_interfaces(self, container, netns):
+        return []
+
+    def apply(self, container, netcfg=None, detach=False):
+        key = (container.name, self.name)
+        if detach:
+            FakeNetwork.applied.pop(key, None)
+            return True
+
+        if FakeNetwork.fail_after is not None:
+            if FakeNetwork.fail_after == 0:
+                FakeNetwork.fail_after = None
+                return False
+            FakeNetwork.fail_after -= 1
+
+        FakeNetwork.applied[key] = netcfg
+        FakeNetwork.drifted.discard(key)
+        return True
+
+    def verify(self, container, netcfg, netns, host_state, netns_state):
+        if (container.name, self.name) in FakeNetwork.drifted:
+            return ["interface of '%s' is missing" % container.name]
+        return []
+
+
+def register():
+    """
+    Makes the fake network type available to configuration loading.
+    """
+
+    FakeNetwork.reset()
+    network._classes['fake'] = FakeNetwork
+
+
+def unregister():
+    network._classes.pop('fake', None)
+
+
+def make_data(networks, containers, network_type='fake'):
+    """
+    Returns serialized configuration.
+
+    :param networks: List of network names
+    :param containers: Dictionary mapping container names to dictionaries
+      of network configuration
+    """
+
+    return {
+        'networks': {
+            name: {'name': name, 'type': network_type, 'destroy_on_stop': False}
+            for name in networks
+        },
+        'containers': {
+            name: {'name': name, 'networks': attachments}
+            for name, attachments in containers.items()
+        },
+    }
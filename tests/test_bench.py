@@ -0,0 +1,46 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from netcfg import bench
+
+
+class FakeClient(object):
+    def __init__(self, replication):
+        self.replication = replication
+
+    def get_stats(self):
+        return {'stats': {'replication': self.replication}}
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.docker_socket_path = os.path.join(self.path, 'docker.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def make_benchmark(self, **kwargs):
+        return bench.Benchmark(
+            os.path.join(self.path, 'ipc.sock'),
+            os.path.join(self.path, 'ipc.sock.events'),
+            self.docker_socket_path,
+            **kwargs
+        )
+
+    def test_no_networks(self):
+        with self.assertRaises(bench.BenchmarkError):
+            self.make_benchmark(networks=0)
+        self.assertFalse(os.path.exists(self.docker_socket_path))
+
+    def test_follower(self):
+        benchmark = self.make_benchmark()
+        benchmark.get_client = lambda: FakeClient({'role': 'follower'})
+        with self.assertRaises(bench.BenchmarkError):
+            benchmark.run()
+
+        # Nothing has been changed and the fake Docker socket is removed
+        self.assertEqual(benchmark.stats.samples, {})
+        self.assertFalse(os.path.exists(self.docker_socket_path))
@@ -0,0 +1,93 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import zmq
+
+from netcfg import client
+from netcfg import daemon
+
+
+class SubscribeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        ipc_socket_path = os.path.join(self.path, 'ipc.sock')
+        self.daemon = daemon.Daemon(
+            ipc_socket_path,
+            os.path.join(self.path, 'docker.sock'),
+            os.path.join(self.path, 'netcfg.json'),
+            verify_interval=0,
+        )
+        self.daemon.socket_events = self.daemon.context.socket(zmq.PUB)
+        self.daemon.socket_events.bind('ipc://%s.events' % ipc_socket_path)
+
+        self.client = client.Client(ipc_socket_path)
+        self.client.get_config = lambda: json.loads(self.daemon.process_rpc(json.dumps({'method': 'get_config'})))
+        self.subscriptions = []
+
+    def tearDown(self):
+        for events in self.subscriptions:
+            events.close()
+        self.client.socket.close(0)
+        self.client.context.term()
+        self.daemon.socket_events.close(0)
+        self.daemon.context.term()
+        shutil.rmtree(self.path)
+
+    def subscribe(self, **kwargs):
+        events = self.client.subscribe(**kwargs)
+        self.subscriptions.append(events)
+        snapshot = next(events)
+
+        # Allow the subscription to take effect
+        time.sleep(0.2)
+        return events, snapshot
+
+    def test_snapshot(self):
+        self.daemon.publish('attach', container='a', network='foo0')
+        events, snapshot = self.subscribe(events=['attach'])
+        self.assertEqual(snapshot['event'], 'resync')
+        self.assertEqual(snapshot['seq'], 1)
+        self.assertIn('config', snapshot)
+
+        self.daemon.publish('attach', container='b', network='foo0')
+        event = next(events)
+        self.assertEqual((event['container'], event['seq'], event['topic_seq']), ('b', 2, 2))
+
+    def test_topic_filter(self):
+        events, _ = self.subscribe(events=['attach'])
+        self.daemon.publish('attach', container='a', network='foo0')
+        self.daemon.publish('detach', container='a', network='foo0')
+        self.daemon.publish('attach', container='b', network='foo0')
+
+        # Skipped sequence numbers of other event types are not gaps
+        self.assertEqual([next(events)['container'] for _ in xrange(2)], ['a', 'b'])
+
+        # A missed event of a subscribed type is a gap
+        self.daemon.sequence += 1
+        self.daemon.topic_sequences['attach'] += 1
+        self.daemon.publish('attach', container='c', network='foo0')
+        snapshot = next(events)
+        self.assertEqual(snapshot['event'], 'resync')
+        self.assertEqual(snapshot['seq'], 5)
+
+        self.daemon.publish('attach', container='d', network='foo0')
+        event = next(events)
+        self.assertEqual((event['container'], event['topic_seq']), ('d', 5))
+
+    def test_gap(self):
+        events, _ = self.subscribe()
+        self.daemon.publish('attach', container='a', network='foo0')
+        self.assertEqual(next(events)['container'], 'a')
+
+        self.daemon.sequence += 1
+        self.daemon.publish('detach', container='a', network='foo0')
+        self.assertEqual(next(events)['event'], 'resync')
+
+        # Events included in the resynced configuration are skipped
+        self.daemon.sequence -= 1
+        self.daemon.publish('detach', container='b', network='foo0')
+        self.daemon.publish('attach', container='c', network='foo0')
+        self.assertEqual(next(events)['container'], 'c')
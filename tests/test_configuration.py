@@ -0,0 +1,230 @@
+import json
+import StringIO
+import unittest
+
+from netcfg import configuration
+from netcfg.network import base
+
+
+def make_config(networks, containers):
+    """
+    Returns configuration loaded from serialized networks and containers.
+
+    :param networks: Dictionary mapping network names to destroy_on_stop flags
+    :param containers: Dictionary mapping container names to dictionaries
+      of network configuration
+    """
+
+    data = {
+        'networks': {
+            name: {'name': name, 'type': 'bridge', 'destroy_on_stop': destroy_on_stop}
+            for name, destroy_on_stop in networks.items()
+        },
+        'containers': {
+            name: {'name': name, 'networks': attachments}
+            for name, attachments in containers.items()
+        },
+    }
+
+    config = configuration.Configuration('/var/run/docker.sock')
+    config.deserialize(data)
+    return config
+
+
+class LoadTestCase(unittest.TestCase):
+    def test_containers_before_networks(self):
+        expected = make_config(
+            {'foo0': False},
+            {'a': {'foo0': {'address': ['10.0.0.1/24']}}, 'b': {'foo0': None}},
+        ).serialize()
+
+        document = '{"containers": %s, "networks": %s}' % (
+            json.dumps(expected['containers']),
+            json.dumps(expected['networks']),
+        )
+        config = configuration.Configuration('/var/run/docker.sock')
+        config.load(StringIO.StringIO(document))
+        self.assertEqual(config.serialize(), expected)
+        self.assertEqual(config.get_container_names(), ['a', 'b'])
+
+    def test_dump_load(self):
+        config = make_config(
+            {'foo0': False, 'bar0': True},
+            {'a': {'foo0': {'address': ['10.0.0.1/24', '2001:db8::1/64']}, 'bar0': None}},
+        )
+        fp = StringIO.StringIO()
+        config.dump(fp)
+
+        loaded = configuration.Configuration('/var/run/docker.sock')
+        loaded.load(StringIO.StringIO(fp.getvalue()))
+        self.assertEqual(loaded.serialize(), config.serialize())
+        self.assertEqual(config.diff(loaded), [])
+
+    def test_truncated(self):
+        fp = StringIO.StringIO()
+        make_config({'foo0': False}, {'a': {'foo0': None}}).dump(fp)
+
+        config = configuration.Configuration('/var/run/docker.sock')
+        with self.assertRaises(ValueError):
+            config.load(StringIO.StringIO(fp.getvalue()[:-2]))
+
+
+class DiffTestCase(unittest.TestCase):
+    def diff(self, old, new):
+        return {
+            change.name: (
+                sorted(att.network.name for att in change.removed),
+                sorted(att.network.name for att in change.added),
+            )
+            for change in old.diff(new)
+        }
+
+    def test_unchanged(self):
+        containers = {'a': {'foo0': {'address': ['10.0.0.1/24']}}}
+        self.assertEqual(self.diff(make_config({'foo0': False}, containers),
+                                   make_config({'foo0': False}, containers)), {})
+
+    def test_attachments(self):
+        old = make_config({'foo0': False, 'bar0': False}, {
+            'a': {'foo0': {'address': ['10.0.0.1/24']}},
+            'b': {'foo0': {'address': ['10.0.0.2/24']}, 'bar0': None},
+            'c': {'foo0': None},
+        })
+        new = make_config({'foo0': False, 'bar0': False}, {
+            'a': {'foo0': {'address': ['10.0.0.1/24']}},
+            'b': {'foo0': {'address': ['10.0.0.3/24']}},
+            'd': {'bar0': None},
+        })
+
+        self.assertEqual(self.diff(old, new), {
+            'b': (['bar0', 'foo0'], ['foo0']),
+            'c': (['foo0'], []),
+            'd': ([], ['bar0']),
+        })
+
+    def test_network_metadata(self):
+        containers = {'a': {'foo0': None}}
+        old = make_config({'foo0': False}, containers)
+        new = make_config({'foo0': True}, containers)
+
+        # Changing destroy_on_stop does not affect applied configuration
+        self.assertEqual(self.diff(old, new), {})
+        self.assertEqual(old.diff_networks(new), (set(), set(), set(['foo0'])))
+        self.assertEqual(old.diff_networks(new, applied=True), (set(), set(), set()))
+
+
+class QueryTestCase(unittest.TestCase):
+    def setUp(self):
+        containers = {}
+        for index in xrange(25):
+            attachments = {'foo0': {'address': ['10.0.0.%d/24' % (index + 1)]}}
+            if index % 2:
+                attachments['bar0'] = {'address': ['2001:db8::%x/64' % (index + 1)]}
+            containers['ctr%02d' % index] = attachments
+        containers['other'] = {'bar0': None}
+
+        self.config = make_config({'foo0': False, 'bar0': False}, containers)
+
+    def query_all(self, **kwargs):
+        names = []
+        cursor = None
+        while True:
+            result, cursor = self.config.query(cursor=cursor, **kwargs)
+            names.extend(sorted(result['containers']))
+            if cursor is None:
+                return names
+
+    def test_all(self):
+        result, cursor = self.config.query()
+        self.assertIsNone(cursor)
+        self.assertEqual(result, self.config.serialize())
+
+    def test_pagination(self):
+        expected = sorted(self.config.containers)
+        for limit in (1, 2, 7, 26, 100):
+            self.assertEqual(self.query_all(limit=limit), expected, 'limit %d' % limit)
+
+        result, cursor = self.config.query(limit=10)
+        self.assertEqual(sorted(result['containers']), expected[:10])
+        self.assertEqual(cursor, expected[9])
+
+        # Names added after the cursor are included in later pages
+        self.config.add_container('ctr09a')
+        result, cursor = self.config.query(cursor=cursor, limit=1)
+        self.assertEqual(result['containers'].keys(), ['ctr09a'])
+
+    def test_network(self):
+        names = self.query_all(network='bar0', limit=4)
+        self.assertEqual(names, ['ctr%02d' % index for index in xrange(1, 25, 2)] + ['other'])
+
+        result, _ = self.config.query(network='bar0', container='ctr01')
+        self.assertEqual(result['networks'].keys(), ['bar0'])
+        self.assertEqual(result['containers']['ctr01']['networks'].keys(), ['bar0'])
+
+        with self.assertRaises(KeyError):
+            self.config.query(network='missing')
+
+    def test_network_index(self):
+        self.assertEqual(len(self.query_all(network='bar0')), 13)
+
+        # The index of names is kept up to date once it has been built
+        bar0 = self.config.get_network('bar0')
+        ctr = self.config.add_container('ctr00a')
+        ctr.add_attachment(bar0, None)
+        ctr.add_attachment(bar0, {'address': ['2001:db8::100/64']})
+        self.config.get_container('ctr01').detach(bar0, apply=False)
+
+        names = self.query_all(network='bar0')
+        self.assertEqual(names[:2], ['ctr00a', 'ctr03'])
+        self.assertEqual(len(names), 13)
+        self.assertEqual(names, self.config.get_network_container_names(bar0))
+
+    def test_container_pattern(self):
+        self.assertEqual(self.query_all(container='ctr1*', limit=3), ['ctr%02d' % index for index in xrange(10, 20)])
+        self.assertEqual(self.query_all(container='*3'), ['ctr03', 'ctr13', 'ctr23'])
+        self.assertEqual(self.query_all(container='other'), ['other'])
+        self.assertEqual(self.query_all(container='missing*'), [])
+
+    def test_address(self):
+        self.assertEqual(self.query_all(address='10.0.0.0/30', limit=1), ['ctr00', 'ctr01', 'ctr02'])
+        self.assertEqual(self.query_all(address='2001:db8::2/128'), ['ctr01'])
+
+        result, _ = self.config.query(address='2001:db8::/64', container='ctr01', fields=['address'])
+        self.assertEqual(result['containers']['ctr01']['networks'], {'bar0': {'address': ['2001:db8::2/64']}})
+
+
+class BatchNetwork(base.Network):
+    supports_batch_apply = True
+
+    def apply_batch(self, items):
+        # Every other container fails, the others finish one after another
+        return [None if index % 2 else 100.0 + index for index in xrange(len(items))]
+
+
+class RecordingTracker(object):
+    def __init__(self):
+        self.added = []
+
+    def add(self, container, network, netcfg, started, timeout):
+        self.added.append((container.name, network.name, started, timeout))
+
+    def discard(self, container, network):
+        pass
+
+
+class ApplyContainersTestCase(unittest.TestCase):
+    def test_batch_readiness(self):
+        tracker = RecordingTracker()
+        config = configuration.Configuration('/var/run/docker.sock', readiness=tracker)
+        net = config.networks['batch0'] = BatchNetwork('batch0')
+        containers = []
+        for index in xrange(4):
+            ctr = config.add_container('ctr%d' % index)
+            ctr.add_attachment(net, None)
+            containers.append(ctr)
+
+        results = config.apply_containers(containers, wait_ready=5)
+        self.assertEqual(results, {'ctr0': True, 'ctr1': False, 'ctr2': True, 'ctr3': False})
+
+        # Readiness of each container is measured from when its configuration was applied
+        self.assertEqual(tracker.added, [('ctr0', 'batch0', 100.0, 5), ('ctr2', 'batch0', 102.0, 5)])
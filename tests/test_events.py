@@ -0,0 +1,150 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from netcfg import daemon
+from netcfg import utils
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class PendingEventsTestCase(unittest.TestCase):
+    def test_coalesce(self):
+        events = daemon.PendingEvents(10)
+        events.add('a', 'start')
+        events.add('b', 'start')
+        events.add('a', 'die')
+        events.add('a', 'start')
+
+        self.assertEqual(len(events), 2)
+        self.assertEqual(events.pop(), ('a', 'start'))
+        self.assertEqual(events.pop(), ('b', 'start'))
+        self.assertEqual(len(events), 0)
+        self.assertEqual(events.get_stats(), {'pending': 0, 'received': 4, 'coalesced': 2, 'dropped': 0})
+
+    def test_overflow(self):
+        events = daemon.PendingEvents(2)
+        events.add('a', 'start')
+        events.add('b', 'start')
+        events.add('c', 'start')
+        # Events for containers that are already pending are still accepted
+        events.add('a', 'die')
+
+        self.assertTrue(events.overflow)
+        self.assertEqual(len(events), 2)
+        self.assertEqual(events.get_stats()['dropped'], 1)
+        self.assertEqual(events.pop(), ('a', 'die'))
+
+        events.clear()
+        self.assertFalse(events.overflow)
+        self.assertFalse(events)
+
+    def test_coalesce_delay(self):
+        clock = FakeClock()
+        events = daemon.PendingEvents(10, delay=0.5, clock=clock)
+        self.assertIsNone(events.get_timeout())
+
+        events.add('a', 'stop')
+        clock.now += 0.25
+        events.add('b', 'start')
+        events.add('a', 'start')
+        self.assertAlmostEqual(events.get_timeout(), 0.25)
+        self.assertFalse(events.is_ready())
+
+        # The delay is measured from the first pending event of a container
+        clock.now += 0.25
+        events.add('a', 'stop')
+        self.assertTrue(events.is_ready())
+        self.assertEqual(events.pop(), ('a', 'stop'))
+        self.assertAlmostEqual(events.get_timeout(), 0.25)
+
+        clock.now += 0.25
+        self.assertEqual(events.pop(), ('b', 'start'))
+        self.assertIsNone(events.get_timeout())
+
+
+class DrainEventsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.daemon = daemon.Daemon(
+            os.path.join(self.path, 'ipc.sock'),
+            os.path.join(self.path, 'docker.sock'),
+            os.path.join(self.path, 'netcfg.json'),
+            verify_interval=0,
+        )
+        self.published = []
+        self.daemon.publish = lambda event, **kwargs: self.published.append((event, kwargs.get('container')))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_held_back(self):
+        clock = FakeClock()
+        applied = []
+        self.daemon.pending_events = daemon.PendingEvents(10, delay=0.5, clock=clock)
+        self.daemon.apply_containers = lambda containers: applied.append([ctr.name for ctr in containers])
+        for name in ('a', 'b'):
+            self.daemon.config.add_container(name)
+
+        self.daemon.pending_events.add('a', 'start')
+        self.daemon.pending_events.add('b', 'start')
+        self.daemon.drain_events()
+        self.assertEqual(applied, [])
+        self.assertEqual(self.daemon.get_poll_timeout(), 500)
+
+        clock.now += 0.5
+        self.daemon.drain_events()
+        self.assertEqual(applied, [['a', 'b']])
+        self.assertIsNone(self.daemon.pending_events.get_timeout())
+
+    def test_overflow_publishes_results(self):
+        self.daemon.config.apply = lambda: {'b': False, 'a': True}
+        self.daemon.pending_events.overflow = True
+        self.daemon.drain_events()
+
+        self.assertEqual(self.published, [('container_applied', 'a'), ('container_failed', 'b')])
+        self.assertFalse(self.daemon.pending_events.overflow)
+
+
+class TokenBucketTestCase(unittest.TestCase):
+    def test_burst(self):
+        clock = FakeClock()
+        bucket = utils.TokenBucket(10, burst=3, clock=clock)
+
+        self.assertTrue(bucket.consume())
+        self.assertTrue(bucket.consume(2))
+        self.assertFalse(bucket.consume())
+        self.assertAlmostEqual(bucket.delay(), 0.1)
+
+    def test_refill(self):
+        clock = FakeClock()
+        bucket = utils.TokenBucket(4, burst=3, clock=clock)
+        bucket.consume(3)
+
+        clock.now += 0.125
+        self.assertFalse(bucket.consume())
+        self.assertAlmostEqual(bucket.delay(), 0.125)
+
+        clock.now += 0.125
+        self.assertEqual(bucket.delay(), 0.0)
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+
+        # Tokens never exceed the burst size
+        clock.now += 60
+        self.assertTrue(bucket.consume(3))
+        self.assertFalse(bucket.consume())
+
+    def test_defaults(self):
+        clock = FakeClock()
+        bucket = utils.TokenBucket(0.5, clock=clock)
+        self.assertEqual(bucket.burst, 1)
+        self.assertTrue(bucket.consume())
+        self.assertAlmostEqual(bucket.delay(), 2.0)
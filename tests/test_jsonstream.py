@@ -0,0 +1,76 @@
+import json
+import StringIO
+import unittest
+
+from netcfg import jsonstream
+
+DOCUMENT = {
+    'networks': {
+        'foo0': {'name': 'foo0', 'type': 'bridge', 'destroy_on_stop': False},
+        'bar0': {'name': 'bar0', 'type': 'bridge', 'destroy_on_stop': True},
+    },
+    'containers': {
+        'a': {'name': 'a', 'networks': {'foo0': {'address': ['10.0.0.1/24'], 'mtu': 1500}}},
+        'b': {'name': 'b', 'networks': {'foo0': None, 'bar0': {'address': [], 'weight': -1.25e3}}},
+        'c': {'name': 'c', 'networks': {}},
+    },
+    'version': 12345,
+    'escaped': u'quote " brace } comma , \u017e',
+}
+
+
+class JSONStreamReaderTestCase(unittest.TestCase):
+    def read(self, document, chunk_size, nested=('networks', 'containers')):
+        reader = jsonstream.JSONStreamReader(StringIO.StringIO(document), chunk_size=chunk_size)
+        result = {}
+        for key, value in reader.iter_object(nested=nested):
+            if key in nested:
+                value = dict(value)
+            result[key] = value
+        return result
+
+    def test_chunk_sizes(self):
+        document = json.dumps(DOCUMENT)
+        for chunk_size in (1, 2, 3, 7, jsonstream.CHUNK_SIZE):
+            self.assertEqual(self.read(document, chunk_size), DOCUMENT, 'chunk size %d' % chunk_size)
+
+    def test_whitespace(self):
+        document = json.dumps(DOCUMENT, indent=4)
+        for chunk_size in (1, 2, 3, 7):
+            self.assertEqual(self.read(document, chunk_size), DOCUMENT, 'chunk size %d' % chunk_size)
+
+    def test_empty_objects(self):
+        document = '{"networks": {}, "containers": { }}'
+        self.assertEqual(self.read(document, 1), {'networks': {}, 'containers': {}})
+        self.assertEqual(self.read(' {} ', 1), {})
+
+    def test_unread_members_are_skipped(self):
+        reader = jsonstream.JSONStreamReader(StringIO.StringIO(json.dumps(DOCUMENT)), chunk_size=3)
+        keys = [key for key, _ in reader.iter_object(nested=('networks', 'containers'))]
+        self.assertEqual(sorted(keys), sorted(DOCUMENT))
+
+    def test_truncated(self):
+        document = json.dumps(DOCUMENT)
+        for length in (0, 1, len(document) / 3, len(document) / 2, len(document) - 1):
+            for chunk_size in (1, 7):
+                with self.assertRaises(ValueError):
+                    self.read(document[:length], chunk_size)
+
+    def test_invalid(self):
+        for document in ('[]', '{"a" 1}', '{"a": 1 "b": 2}', '{"networks": [1]}'):
+            with self.assertRaises(ValueError):
+                self.read(document, 2)
+
+
+class DumpObjectTestCase(unittest.TestCase):
+    def test_roundtrip(self):
+        fp = StringIO.StringIO()
+        jsonstream.dump_object(fp, [
+            ('networks', ((k, v) for k, v in DOCUMENT['networks'].items())),
+            ('containers', ((k, v) for k, v in DOCUMENT['containers'].items())),
+            ('version', DOCUMENT['version']),
+        ])
+
+        expected = dict(DOCUMENT)
+        del expected['escaped']
+        self.assertEqual(json.loads(fp.getvalue()), expected)
@@ -0,0 +1,209 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from netcfg import configuration
+from netcfg import ledger
+from netcfg.network import base
+from netcfg.network import state
+
+from . import fakes
+
+
+class FakeContainer(object):
+    def __init__(self, name, container_id, pid):
+        self.name = name
+        self.state = (container_id, pid)
+
+    def get_state(self):
+        return self.state
+
+
+class FakeNetwork(base.Network):
+    def get_type(self):
+        return 'fake'
+
+    def get_interfaces(self, container, netns):
+        return ['veth-%s' % container.name]
+
+
+class FakeDockerClient(object):
+    def __init__(self):
+        self.inspected = []
+
+    def inspect_container(self, name):
+        self.inspected.append(name)
+        return {'Id': 'id-%s' % name, 'State': {'Running': True, 'Pid': os.getpid()}}
+
+
+class AppliedNetwork(FakeNetwork):
+    def apply(self, container, netcfg, detach=False):
+        return container.get_netns() is not None
+
+
+class LedgerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.state_path = os.path.join(self.path, 'state.json')
+        self.network = FakeNetwork('foo0')
+        self.pid = os.getpid()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def make_ledger(self, compact_min_entries=ledger.COMPACT_MIN_ENTRIES):
+        result = ledger.Ledger(self.state_path, compact_min_entries=compact_min_entries)
+        result.load()
+        return result
+
+    def test_record_and_load(self):
+        first = self.make_ledger()
+        first.record(FakeContainer('a', 'id-a', self.pid), self.network, {'address': ['10.0.0.1/24']})
+        first.record(FakeContainer('b', 'id-b', self.pid), self.network, None)
+        first.save()
+
+        second = self.make_ledger()
+        self.assertEqual(second.records, first.records)
+        applied = second.get_applied('a', 'id-a')
+        self.assertEqual(applied['foo0']['config'], {'address': ['10.0.0.1/24']})
+        self.assertEqual(applied['foo0']['interfaces'], ['veth-a'])
+
+        # Restarted containers have no applied configuration
+        self.assertIsNone(second.get_applied('a', 'id-other'))
+        self.assertIsNone(second.get_applied('missing', 'id-a'))
+
+    def test_remove_and_prune(self):
+        first = self.make_ledger()
+        for name in ('a', 'b', 'c'):
+            first.record(FakeContainer(name, 'id-%s' % name, self.pid), self.network, None)
+        first.save()
+
+        first.remove(FakeContainer('a', 'id-a', self.pid), self.network)
+        first.prune(set(['id-a', 'id-c']))
+        first.save()
+
+        second = self.make_ledger()
+        self.assertEqual(sorted(second.records), ['c'])
+
+    def test_save_appends_modified(self):
+        first = self.make_ledger()
+        for index in xrange(10):
+            first.record(FakeContainer('c%d' % index, 'id', self.pid), self.network, None)
+        first.save()
+        first.save()
+
+        container = FakeContainer('c3', 'id', self.pid)
+        first.record(container, self.network, {'mtu': 1400})
+        first.save()
+
+        # Only modified containers are written, the snapshot is left alone
+        self.assertFalse(os.path.exists(self.state_path))
+        with open(first.journal_path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 11)
+        self.assertEqual(json.loads(lines[-1])[0], 'c3')
+
+        first.remove(container, self.network)
+        first.save()
+        self.assertNotIn('c3', self.make_ledger().records)
+
+    def test_compact(self):
+        first = self.make_ledger(compact_min_entries=5)
+        for mtu in xrange(1400, 1405):
+            for index in xrange(3):
+                first.record(FakeContainer('c%d' % index, 'id', self.pid), self.network, {'mtu': mtu})
+            first.save()
+
+        self.assertTrue(os.path.exists(self.state_path))
+        self.assertLessEqual(first.journal_entries, 5)
+        self.assertEqual(self.make_ledger().records, first.records)
+
+    def test_corrupted(self):
+        first = self.make_ledger()
+        first.record(FakeContainer('a', 'id-a', self.pid), self.network, None)
+        first.save()
+        with open(first.journal_path, 'a') as f:
+            f.write('["b", {"id": ')
+        with open(self.state_path, 'w') as f:
+            f.write('{"x": ')
+
+        second = self.make_ledger()
+        self.assertEqual(sorted(second.records), ['a'])
+
+
+class ApplyStateTestCase(unittest.TestCase):
+    def test_single_inspect(self):
+        path = tempfile.mkdtemp()
+        try:
+            config = configuration.Configuration('/var/run/docker.sock', ledger=ledger.Ledger(os.path.join(path, 'state.json')))
+            config.docker_client = FakeDockerClient()
+            networks = [AppliedNetwork('foo%d' % index) for index in xrange(3)]
+            ctr = config.add_container('a')
+            for net in networks:
+                config.networks[net.name] = net
+                ctr.add_attachment(net, None)
+
+            self.assertTrue(ctr.apply())
+            self.assertEqual(config.docker_client.inspected, ['a'])
+            self.assertEqual(sorted(config.ledger.records['a']['networks']), ['foo0', 'foo1', 'foo2'])
+
+            # State is obtained again for the next apply
+            self.assertTrue(ctr.apply_network(networks[0], None))
+            self.assertEqual(config.docker_client.inspected, ['a', 'a'])
+        finally:
+            shutil.rmtree(path)
+
+
+class ReconcileTestCase(unittest.TestCase):
+    def setUp(self):
+        fakes.register()
+        self.path = tempfile.mkdtemp()
+        self.dumps = []
+        self.dump_host = state.dump_host
+        self.dump_netns = state.dump_netns
+        state.dump_host = lambda: self.dumps.append('host')
+        state.dump_netns = lambda netns: self.dumps.append(netns)
+
+        self.config = configuration.Configuration(
+            '/var/run/docker.sock', ledger=ledger.Ledger(os.path.join(self.path, 'state.json')))
+        self.config.docker_client = fakes.FakeDockerClient()
+        self.config.deserialize(fakes.make_data(
+            ['foo0', 'bar0'],
+            {'a': {'foo0': {'mtu': 1400}, 'bar0': None}},
+        ))
+        self.container = self.config.get_container('a')
+        self.assertTrue(self.container.apply())
+
+    def tearDown(self):
+        state.dump_host = self.dump_host
+        state.dump_netns = self.dump_netns
+        fakes.unregister()
+        shutil.rmtree(self.path)
+
+    def reconcile(self):
+        fakes.FakeNetwork.applied = {}
+        applied = self.config.ledger.get_applied('a', 'id-a')
+        return self.config.reconcile_container(self.container, applied)
+
+    def test_unchanged(self):
+        self.assertTrue(self.reconcile())
+        self.assertEqual(fakes.FakeNetwork.applied, {})
+
+        # Kernel state is dumped once per container
+        self.assertEqual(self.dumps, ['host', str(os.getpid())])
+
+    def test_drifted(self):
+        fakes.FakeNetwork.drifted.add(('a', 'bar0'))
+        self.assertTrue(self.reconcile())
+        self.assertEqual(fakes.FakeNetwork.applied, {('a', 'bar0'): None})
+        self.assertEqual(fakes.FakeNetwork.drifted, set())
+
+    def test_state_unavailable(self):
+        def fail(netns):
+            raise OSError('ip not found')
+
+        state.dump_netns = fail
+        self.assertTrue(self.reconcile())
+        self.assertEqual(fakes.FakeNetwork.applied, {('a', 'foo0'): {'mtu': 1400}, ('a', 'bar0'): None})
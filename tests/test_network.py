@@ -0,0 +1,29 @@
+import unittest
+
+from netcfg import network
+from netcfg.network import base
+from netcfg.network import bridge
+
+
+class NetworkTypesTestCase(unittest.TestCase):
+    def setUp(self):
+        network._types = None
+        network._classes.clear()
+
+    def test_builtin(self):
+        self.assertIs(network.get_class_for_type('bridge'), bridge.BridgeNetwork)
+        # Entry points are not scanned for built-in types
+        self.assertIsNone(network._types)
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            network.get_class_for_type('unknown')
+        self.assertIn('bridge', network.get_types())
+
+    def test_not_a_network(self):
+        network._types = {'invalid': 'netcfg.network.base:NetworkConfigurationError'}
+        with self.assertRaises(ValueError):
+            network.get_class_for_type('invalid')
+
+        network._types = {'base': 'netcfg.network.base:Network'}
+        self.assertIs(network.get_class_for_type('base'), base.Network)
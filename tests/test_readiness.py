@@ -0,0 +1,113 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from netcfg import configuration
+from netcfg import daemon
+from netcfg import readiness
+
+from . import fakes
+
+
+class TimedNetwork(fakes.FakeNetwork):
+    def apply(self, container, netcfg=None, detach=False):
+        success = super(TimedNetwork, self).apply(container, netcfg, detach=detach)
+        self.applied_at = time.time()
+        return success
+
+
+class PendingNetwork(fakes.FakeNetwork):
+    def check_ready(self, container, netcfg, netns):
+        return None
+
+
+class ReadinessTrackerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tracker = readiness.ReadinessTracker(interval=0)
+        self.config = configuration.Configuration('/var/run/docker.sock', readiness=self.tracker)
+        self.config.docker_client = fakes.FakeDockerClient()
+        self.container = self.config.add_container('a')
+        self.published = []
+
+    def publish(self, event, **kwargs):
+        self.published.append((event, kwargs['container'], kwargs['network'], kwargs['ready']))
+
+    def test_measured_after_apply(self):
+        net = TimedNetwork('foo0')
+        self.assertTrue(self.container.apply_network(net, None, wait_ready=5))
+        self.assertGreaterEqual(self.tracker.pending[('a', 'foo0')][4], net.applied_at)
+
+        # Without a timeout readiness is not tracked
+        self.assertTrue(self.container.apply_network(fakes.FakeNetwork('bar0'), None))
+        self.assertEqual(self.tracker.pending.keys(), [('a', 'foo0')])
+
+    def test_status(self):
+        self.assertIsNone(self.tracker.get_status('a', 'foo0'))
+
+        self.container.apply_network(fakes.FakeNetwork('foo0'), None, wait_ready=5)
+        self.assertEqual(self.tracker.get_status('a', 'foo0'), {'pending': True})
+
+        self.tracker.tick(self)
+        self.assertEqual(self.published[0][:3], ('network_ready', 'a', 'foo0'))
+        status = self.tracker.get_status('a', 'foo0')
+        self.assertFalse(status['pending'])
+        self.assertEqual(status['ready'], self.published[0][3])
+
+    def test_timeout(self):
+        self.container.apply_network(PendingNetwork('foo0'), None, wait_ready=0.01)
+        self.tracker.tick(self)
+        self.assertEqual(self.published, [])
+
+        time.sleep(0.02)
+        self.tracker.tick(self)
+        self.assertEqual(self.published, [('network_ready', 'a', 'foo0', None)])
+        self.assertEqual(self.tracker.get_status('a', 'foo0'), {'pending': False, 'ready': None})
+        self.assertEqual(self.tracker.get_stats()['timeouts'], 1)
+
+
+class AttachTestCase(unittest.TestCase):
+    def setUp(self):
+        fakes.register()
+        self.docker_client = fakes.FakeDockerClient()
+        self.get_docker_client = configuration.Configuration.get_docker_client
+        configuration.Configuration.get_docker_client = lambda config: self.docker_client
+
+        self.path = tempfile.mkdtemp()
+        self.config_path = os.path.join(self.path, 'netcfg.json')
+        self.daemon = daemon.Daemon(
+            os.path.join(self.path, 'ipc.sock'),
+            os.path.join(self.path, 'docker.sock'),
+            self.config_path,
+            verify_interval=0,
+        )
+        self.daemon.publish = lambda event, **kwargs: None
+        self.call('set_config', config=fakes.make_data(['foo0'], {}))
+
+    def tearDown(self):
+        configuration.Configuration.get_docker_client = self.get_docker_client
+        fakes.unregister()
+        shutil.rmtree(self.path)
+
+    def call(self, method, **kwargs):
+        msg = dict(kwargs, method=method)
+        return json.loads(self.daemon.process_rpc(json.dumps(msg)))
+
+    def test_wait_ready_not_stored(self):
+        rsp = self.call('attach', container='a', network='foo0', config={'mtu': 1400}, wait_ready=5)
+        self.assertTrue(rsp['applied'])
+        self.assertEqual(self.call('get_readiness', container='a', network='foo0'), {'readiness': {'pending': True}})
+
+        expected = {'a': {'name': 'a', 'networks': {'foo0': {'mtu': 1400}}}}
+        self.assertEqual(self.call('get_config')['config']['containers'], expected)
+        with open(self.config_path) as f:
+            self.assertEqual(json.load(f)['containers'], expected)
+
+    def test_invalid_wait_ready(self):
+        for wait_ready in (-1, readiness.MAX_WAIT_READY + 1, True, '5'):
+            rsp = self.call('attach', container='a', network='foo0', wait_ready=wait_ready)
+            self.assertIn('error', rsp)
+
+        self.assertEqual(self.call('get_config')['config']['containers'], {})
@@ -0,0 +1,203 @@
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+import zmq
+
+from netcfg import configuration
+from netcfg import daemon
+from netcfg import replication
+
+from . import fakes
+
+
+class StoppedDockerClient(fakes.FakeDockerClient):
+    def inspect_container(self, name):
+        return {'Id': 'id-%s' % name, 'State': {'Running': False, 'Pid': 0}}
+
+
+def get_address():
+    """
+    Returns a replication address on localhost, whose port and the next one
+    are likely to be free.
+    """
+
+    for _ in xrange(100):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        check = socket.socket()
+        try:
+            check.bind(('127.0.0.1', port + 1))
+        except socket.error:
+            continue
+        finally:
+            check.close()
+
+        return 'tcp://127.0.0.1:%d' % port
+
+    raise RuntimeError('No free ports found.')
+
+
+class ReplicationTestCase(unittest.TestCase):
+    def setUp(self):
+        fakes.register()
+        self.get_docker_client = configuration.Configuration.get_docker_client
+        docker_client = StoppedDockerClient()
+        configuration.Configuration.get_docker_client = lambda config: docker_client
+
+        self.path = tempfile.mkdtemp()
+        address = get_address()
+        self.leader = self.make_daemon('leader')
+        self.leader.replication = replication.ReplicationLeader(self.leader.context, address, self.leader.epoch)
+        self.follower = self.make_daemon('follower')
+        self.follower.replication = replication.ReplicationFollower(self.follower.context, address, 'follower')
+
+        self.rpc(self.leader, 'create_network', type='fake', name='foo0', destroy_on_stop=False)
+        self.connect()
+
+    def tearDown(self):
+        self.leader.replication.socket_pub.close(0)
+        for instance in (self.leader, self.follower):
+            for sock in instance.replication.sockets:
+                sock.close(0)
+            instance.context.term()
+
+        configuration.Configuration.get_docker_client = self.get_docker_client
+        fakes.unregister()
+        shutil.rmtree(self.path)
+
+    def make_daemon(self, name):
+        os.mkdir(os.path.join(self.path, name))
+        return daemon.Daemon(
+            os.path.join(self.path, name, 'ipc.sock'),
+            os.path.join(self.path, name, 'docker.sock'),
+            os.path.join(self.path, name, 'netcfg.json'),
+            verify_interval=0,
+        )
+
+    def rpc(self, instance, method, **kwargs):
+        kwargs['method'] = method
+        return json.loads(instance.process_rpc(json.dumps(kwargs)))
+
+    def pump(self, until=None, timeout=5.0):
+        """
+        Delivers replication messages between the daemons until the given
+        condition holds, or until no more messages arrive.
+        """
+
+        poller = zmq.Poller()
+        sockets = {}
+        for instance in (self.leader, self.follower):
+            for sock in instance.replication.sockets:
+                poller.register(sock, zmq.POLLIN)
+                sockets[sock] = instance
+
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if until is not None and until():
+                return True
+
+            events = dict(poller.poll(100))
+            if not events and until is None:
+                return True
+
+            for sock in events:
+                instance = sockets[sock]
+                instance.replication.process(sock, instance)
+
+        return until is None or until()
+
+    def heartbeat(self):
+        self.leader.replication.last_heartbeat = 0
+        self.leader.replication.tick(self.leader)
+
+    def connect(self):
+        # The follower only receives published deltas once its subscription has
+        # reached the leader, which is confirmed by receiving a heartbeat
+        follower = self.follower.replication
+        follower.request_snapshot()
+        self.assertTrue(self.pump(lambda: follower.snapshot_requested is None))
+
+        received = []
+        process = follower.process
+
+        def record(sock, instance):
+            received.append(sock)
+            process(sock, instance)
+
+        follower.process = record
+        try:
+            self.assertTrue(self.pump(lambda: self.heartbeat() or follower.socket_sub in received))
+        finally:
+            del follower.process
+
+        self.pump()
+
+    def assert_in_sync(self):
+        self.assertEqual(self.follower.replication.version, self.leader.replication.version)
+        self.assertEqual(self.follower.config.serialize(), self.leader.config.serialize())
+        follower_stats = self.leader.replication.get_stats()['followers']['follower']
+        self.assertEqual(follower_stats['lag'], 0)
+
+    def test_snapshot(self):
+        self.assert_in_sync()
+        self.assertIn('foo0', self.follower.config.networks)
+
+    def test_deltas(self):
+        self.rpc(self.leader, 'attach', container='a', network='foo0', config={'address': ['10.0.0.1/24']})
+        self.rpc(self.leader, 'attach', container='b', network='foo0', config={})
+        self.rpc(self.leader, 'detach', container='a', network='foo0')
+        self.assertTrue(self.pump(lambda: self.follower.replication.version == 4))
+        self.pump()
+
+        self.assert_in_sync()
+        self.assertEqual(self.follower.replication.get_stats()['errors'], 0)
+        self.assertEqual(sorted(self.follower.config.containers['b'].serialize()['networks']), ['foo0'])
+
+    def test_gap_resync(self):
+        self.rpc(self.leader, 'attach', container='a', network='foo0', config={})
+
+        # Lose the delta on its way to the follower
+        sub = self.follower.replication.socket_sub
+        self.assertTrue(sub.poll(5000))
+        sub.recv_multipart()
+
+        self.rpc(self.leader, 'attach', container='b', network='foo0', config={})
+        self.assertTrue(self.pump(lambda: self.follower.replication.version == 3))
+        self.pump()
+
+        self.assert_in_sync()
+        self.assertEqual(sorted(self.follower.config.containers), ['a', 'b'])
+
+    def test_local_writes_rejected(self):
+        rsp = self.rpc(self.follower, 'create_network', type='fake', name='bar0', destroy_on_stop=False)
+        self.assertIn('managed by the replication leader', rsp['error'])
+        rsp = self.rpc(self.follower, 'attach', container='a', network='foo0', config={})
+        self.assertIn('error', rsp)
+        rsp = self.rpc(self.follower, 'set_config', config=self.leader.config.serialize())
+        self.assertIn('error', rsp)
+
+        # Reading is still allowed
+        self.assertIn('config', self.rpc(self.follower, 'get_config'))
+        self.assert_in_sync()
+
+    def test_malformed_messages(self):
+        pub = self.leader.replication.socket_pub
+        for frames in (['delta', 'not json'], ['delta', '[]'], ['heartbeat', '{}'],
+                       ['delta', json.dumps({'epoch': 1, 'version': 'x', 'request': {}})],
+                       ['unknown', '{}'], ['single']):
+            pub.send_multipart(frames)
+
+        self.rpc(self.leader, 'attach', container='a', network='foo0', config={})
+        self.assertTrue(self.pump(lambda: self.follower.replication.version == 2 and
+                                  self.follower.replication.snapshot_requested is None))
+        self.pump()
+
+        self.assert_in_sync()
+        self.assertGreaterEqual(self.follower.replication.errors, 1)
@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from netcfg import configuration
+from netcfg import daemon
+
+from . import fakes
+
+
+def addresses(*indices):
+    return {
+        'ctr%d' % index: {'foo0': {'address': ['10.0.0.%d/24' % (index + offset)]}}
+        for index, offset in indices
+    }
+
+
+OLD = fakes.make_data(['foo0'], addresses((0, 10), (1, 10), (2, 10), (3, 10)))
+NEW = fakes.make_data(['foo0'], addresses((0, 20), (1, 20), (2, 20), (3, 20)))
+
+
+def applied(data):
+    return {
+        (name, netname): netcfg
+        for name, ctr in data['containers'].items()
+        for netname, netcfg in ctr['networks'].items()
+    }
+
+
+class SetConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        fakes.register()
+        self.docker_client = fakes.FakeDockerClient()
+        self.get_docker_client = configuration.Configuration.get_docker_client
+        configuration.Configuration.get_docker_client = lambda config: self.docker_client
+
+        self.path = tempfile.mkdtemp()
+        self.daemon = daemon.Daemon(
+            os.path.join(self.path, 'ipc.sock'),
+            os.path.join(self.path, 'docker.sock'),
+            os.path.join(self.path, 'netcfg.json'),
+            verify_interval=0,
+        )
+        self.published = []
+        self.daemon.publish = lambda event, **kwargs: self.published.append(event)
+
+        self.assertIn('success', self.set_config(OLD))
+        self.assertEqual(fakes.FakeNetwork.applied, applied(OLD))
+
+    def tearDown(self):
+        configuration.Configuration.get_docker_client = self.get_docker_client
+        fakes.unregister()
+        shutil.rmtree(self.path)
+
+    def set_config(self, data, **kwargs):
+        replicated = kwargs.pop('replicated', False)
+        msg = dict(kwargs, method='set_config', config=data)
+        return json.loads(self.daemon.process_rpc(json.dumps(msg), replicated=replicated))
+
+    def saved_config(self):
+        with open(self.daemon.config_path) as f:
+            return json.load(f)
+
+    def test_delta(self):
+        data = fakes.make_data(['foo0'], dict(addresses((0, 10), (1, 10), (2, 30)), ctr4={'foo0': None}))
+        rsp = self.set_config(data)
+        self.assertEqual(rsp['changes']['containers'], ['ctr2', 'ctr3', 'ctr4'])
+        self.assertEqual(fakes.FakeNetwork.applied, applied(data))
+        self.assertEqual(self.daemon.config.serialize(), data)
+
+    def test_rollback(self):
+        # The third attach fails after two containers have already been changed
+        fakes.FakeNetwork.fail_after = 2
+        rsp = self.set_config(NEW)
+
+        self.assertIn('error', rsp)
+        self.assertEqual(fakes.FakeNetwork.applied, applied(OLD))
+        self.assertEqual(self.daemon.config.serialize(), OLD)
+        self.assertEqual(self.saved_config(), OLD)
+        self.assertNotIn('set_config', self.published[1:])
+
+    def test_partial_is_internal(self):
+        fakes.FakeNetwork.fail_after = 2
+        rsp = self.set_config(NEW, partial=True)
+
+        self.assertIn('error', rsp)
+        self.assertEqual(fakes.FakeNetwork.applied, applied(OLD))
+        self.assertEqual(self.daemon.config.serialize(), OLD)
+
+    def test_replicated_is_partial(self):
+        fakes.FakeNetwork.fail_after = 2
+        rsp = self.set_config(NEW, replicated=True)
+
+        self.assertIn('success', rsp)
+        failed = rsp['changes']['failed']
+        self.assertEqual(len(failed), 1)
+        self.assertEqual(self.daemon.config.serialize(), NEW)
+        self.assertEqual(self.saved_config(), NEW)
+
+        # Everything except the failed attachments has been applied
+        expected = applied(NEW)
+        for item in failed:
+            del expected[(item['container'], item['network'])]
+        self.assertEqual(fakes.FakeNetwork.applied, expected)
+
+    def test_stopped_containers(self):
+        self.docker_client.stopped.add('ctr1')
+        rsp = self.set_config(NEW)
+
+        self.assertIn('success', rsp)
+        self.assertEqual(fakes.FakeNetwork.applied[('ctr0', 'foo0')], NEW['containers']['ctr0']['networks']['foo0'])
+        self.assertEqual(fakes.FakeNetwork.applied[('ctr1', 'foo0')], OLD['containers']['ctr1']['networks']['foo0'])
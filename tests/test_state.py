@@ -0,0 +1,62 @@
+import unittest
+
+from netcfg.network import state
+
+LINKS = """\
+1: lo: <LOOPBACK,UP,LOWER_UP> mtu 65536 qdisc noqueue state UNKNOWN mode DEFAULT group default qlen 1000\\    link/loopback 00:00:00:00:00:00 brd 00:00:00:00:00:00
+4: foo0: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 qdisc noqueue state UP mode DEFAULT group default qlen 1000\\    link/ether 6a:2f:1c:00:00:01 brd ff:ff:ff:ff:ff:ff
+5: veth1a2b3c4d@if6: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 qdisc noqueue master foo0 state UP mode DEFAULT group default qlen 1000\\    link/ether 6a:2f:1c:00:00:02 brd ff:ff:ff:ff:ff:ff link-netnsid 0
+7: veth5e6f7a8b@if8: <NO-CARRIER,BROADCAST,MULTICAST,UP> mtu 1500 qdisc noqueue master foo0 state LOWERLAYERDOWN mode DEFAULT group default qlen 1000\\    link/ether 6a:2f:1c:00:00:03 brd ff:ff:ff:ff:ff:ff link-netnsid 1
+9: eth1: <BROADCAST,MULTICAST> mtu 1500 qdisc noop state DOWN mode DEFAULT group default qlen 1000\\    link/ether 6a:2f:1c:00:00:04 brd ff:ff:ff:ff:ff:ff
+"""
+
+ADDRESSES = """\
+1: lo    inet 127.0.0.1/8 scope host lo\\       valid_lft forever preferred_lft forever
+6: eth0    inet 10.0.0.2/24 brd 10.0.0.255 scope global eth0\\       valid_lft forever preferred_lft forever
+6: eth0    inet6 2001:db8::2/64 scope global tentative \\       valid_lft forever preferred_lft forever
+6: eth0    inet6 fe80::682f:1cff:fe00:5/64 scope link \\       valid_lft forever preferred_lft forever
+6: eth0    inet6 invalid scope global \\       valid_lft forever preferred_lft forever
+"""
+
+
+class KernelStateTestCase(unittest.TestCase):
+    def test_links(self):
+        kernel_state = state.KernelState(LINKS)
+        self.assertEqual(sorted(kernel_state.links), ['eth1', 'foo0', 'lo', 'veth1a2b3c4d', 'veth5e6f7a8b'])
+
+        veth = kernel_state.links['veth1a2b3c4d']
+        self.assertEqual(veth.master, 'foo0')
+        self.assertTrue(veth.is_up())
+        self.assertIn('LOWER_UP', veth.flags)
+
+        self.assertEqual(kernel_state.links['veth5e6f7a8b'].master, 'foo0')
+        self.assertNotIn('LOWER_UP', kernel_state.links['veth5e6f7a8b'].flags)
+        self.assertIsNone(kernel_state.links['foo0'].master)
+        self.assertFalse(kernel_state.links['eth1'].is_up())
+        self.assertEqual(kernel_state.addresses, {})
+
+    def test_addresses(self):
+        kernel_state = state.KernelState(ADDRESSES)
+        self.assertEqual(kernel_state.links, {})
+        self.assertEqual(kernel_state.addresses['eth0'], set([
+            '10.0.0.2/24',
+            '2001:db8::2/64',
+            'fe80::682f:1cff:fe00:5/64',
+        ]))
+
+        self.assertTrue(kernel_state.has_address('eth0', '10.0.0.2/24'))
+        self.assertTrue(kernel_state.has_address('eth0', '2001:0db8:0::2/64'))
+        self.assertFalse(kernel_state.has_address('eth0', '10.0.0.2/25'))
+        self.assertFalse(kernel_state.has_address('eth0', 'invalid'))
+        self.assertFalse(kernel_state.has_address('eth1', '10.0.0.2/24'))
+
+    def test_combined(self):
+        kernel_state = state.KernelState(LINKS + ADDRESSES)
+        self.assertEqual(len(kernel_state.links), 5)
+        self.assertIn('lo', kernel_state.addresses)
+
+    def test_empty(self):
+        for output in ('', '\n', 'garbage\n1: x\n'):
+            kernel_state = state.KernelState(output)
+            self.assertEqual(kernel_state.links, {})
+            self.assertEqual(kernel_state.addresses, {})
@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from netcfg import configuration
+from netcfg import ledger
+from netcfg import verifier
+from netcfg.network import state
+
+from . import fakes
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class DriftVerifierTestCase(unittest.TestCase):
+    def setUp(self):
+        fakes.register()
+        self.path = tempfile.mkdtemp()
+        self.clock = FakeClock()
+        self.dumped = []
+        self.dump_host = state.dump_host
+        self.dump_netns = state.dump_netns
+        state.dump_host = lambda: None
+        state.dump_netns = self.fake_dump_netns
+
+        self.ledger = ledger.Ledger(os.path.join(self.path, 'state.json'))
+        self.config = configuration.Configuration('/var/run/docker.sock', ledger=self.ledger)
+        self.config.docker_client = fakes.FakeDockerClient()
+        self.config.deserialize(fakes.make_data(
+            ['foo0'],
+            {'ctr%d' % index: {'foo0': None} for index in xrange(5)},
+        ))
+        for ctr in self.config.containers.values():
+            self.assertTrue(ctr.apply())
+
+        self.published = []
+        self.dump_time = 0
+
+    def tearDown(self):
+        state.dump_host = self.dump_host
+        state.dump_netns = self.dump_netns
+        fakes.unregister()
+        shutil.rmtree(self.path)
+
+    def fake_dump_netns(self, netns):
+        self.dumped.append(netns)
+        self.clock.now += self.dump_time
+
+    def publish(self, event, **kwargs):
+        self.published.append((event, kwargs))
+
+    def make_verifier(self, **kwargs):
+        return verifier.DriftVerifier(interval=0, clock=self.clock, **kwargs)
+
+    def test_count_budget(self):
+        drift = self.make_verifier(budget=2)
+        drift.tick(self)
+        drift.tick(self)
+        drift.tick(self)
+        self.assertEqual(drift.checked, 6)
+        self.assertEqual(drift.cursor, 'ctr0')
+        self.assertEqual(drift.interrupted, 0)
+
+    def test_time_budget(self):
+        self.dump_time = 0.0625
+        drift = self.make_verifier(budget=100, time_budget=0.125)
+        drift.tick(self)
+        self.assertEqual(drift.checked, 2)
+        self.assertEqual(drift.cursor, 'ctr1')
+        self.assertEqual(drift.interrupted, 1)
+
+        # The next cycle continues after the last verified container
+        drift.tick(self)
+        self.assertEqual(drift.checked, 4)
+        self.assertEqual(drift.cursor, 'ctr3')
+
+        # Even a slow container is verified, so every cycle makes progress
+        self.dump_time = 1
+        drift.tick(self)
+        self.assertEqual(drift.checked, 5)
+        self.assertEqual(drift.cursor, 'ctr4')
+        self.assertEqual(drift.get_stats()['last_duration'], 1)
+
+    def test_repair(self):
+        key = ('ctr2', 'foo0')
+        fakes.FakeNetwork.drifted.add(key)
+        del fakes.FakeNetwork.applied[key]
+
+        drift = self.make_verifier()
+        drift.tick(self)
+        self.assertEqual(drift.checked, 5)
+        self.assertEqual((drift.drifted, drift.repaired, drift.failed), (1, 1, 0))
+        self.assertIsNone(fakes.FakeNetwork.applied[key])
+        self.assertEqual(fakes.FakeNetwork.drifted, set())
+        self.assertIn('foo0', self.ledger.records['ctr2']['networks'])
+
+        event, kwargs = self.published[0]
+        self.assertEqual(event, 'drift')
+        self.assertEqual(kwargs['container'], 'ctr2')
+        self.assertTrue(kwargs['repaired'])
+
+        # Repaired configuration is not reported again
+        drift.tick(self)
+        self.assertEqual(drift.drifted, 1)
+        self.assertEqual(len(self.published), 1)
+
+    def test_repair_failed(self):
+        fakes.FakeNetwork.drifted.add(('ctr2', 'foo0'))
+        fakes.FakeNetwork.fail_after = 0
+
+        drift = self.make_verifier()
+        drift.tick(self)
+        self.assertEqual((drift.drifted, drift.repaired, drift.failed), (1, 0, 1))
+        self.assertNotIn(('ctr2', 'foo0'), fakes.FakeNetwork.applied)
+        self.assertFalse(self.published[0][1]['repaired'])